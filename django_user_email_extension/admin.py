@@ -1,12 +1,103 @@
-from django.contrib import admin
-from django.contrib.auth.admin import UserAdmin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 from django_user_email_extension.models import DjangoEmailVerifier, User, UserAddress, UserPhoneNumber
+from django_user_email_extension.utils import chunked
+
+# number of selected objects updated per transaction by admin actions
+ACTION_CHUNK_SIZE = 1000
+
+
+def _selected_id_chunks(queryset):
+    """
+    split the primary keys of selected objects into chunks, each action chunk runs in its own transaction
+    :return: generator of lists of primary keys
+    """
+    return chunked(list(queryset.order_by().values_list('pk', flat=True)), ACTION_CHUNK_SIZE)
+
+
+def _chunked_update(queryset, update):
+    """
+    run a set based update on chunks of the selected objects, a transaction per chunk
+    :param update: callable that gets a QuerySet of a chunk, and returns the number of updated objects
+    :return: total number of updated objects
+    """
+    updated = 0
+    for ids in _selected_id_chunks(queryset):
+        with transaction.atomic(using=queryset.db):
+            updated += update(queryset.model.objects.filter(pk__in=ids))
+    return updated
+
+
+def _resend_verification_emails(model_admin, request, recipients):
+    """
+    resend pending verifications of the selected recipients, each chunk is sent over a single mail connection.
+    for selected users the newest pending verification of each user is sent,
+    for selected verifications exactly the selected pending verifications are sent.
+    subject and body are DJANGO_EMAIL_VERIFIER_RESEND_SUBJECT and DJANGO_EMAIL_VERIFIER_RESEND_BODY settings,
+    the body is formatted with 'email' and 'uuid' of each verification.
+    """
+    body = getattr(settings, 'DJANGO_EMAIL_VERIFIER_RESEND_BODY', None)
+    if not body:
+        model_admin.message_user(request, _('DJANGO_EMAIL_VERIFIER_RESEND_BODY setting is not defined'),
+                                 messages.ERROR)
+        return
+    subject = getattr(settings, 'DJANGO_EMAIL_VERIFIER_RESEND_SUBJECT', 'Verify your email')
+
+    def format_body(verification):
+        return body.format(email=verification.email, uuid=verification.verification_uuid)
+
+    if recipients.model is DjangoEmailVerifier:
+        result = DjangoEmailVerifier.objects.send_selected_verification_emails(
+            subject, format_body, settings.DEFAULT_FROM_EMAIL, recipients)
+        pending_emails = recipients.pending().order_by().values('email').distinct().count()
+    else:
+        result = DjangoEmailVerifier.objects.send_verification_emails(
+            subject, format_body, settings.DEFAULT_FROM_EMAIL, recipients)
+        pending_emails = len(result)
+    sent = sum(result.values())
+    model_admin.message_user(
+        request,
+        _('%(sent)d verification emails sent, %(failed)d failed, %(skipped)d without pending verification') % {
+            'sent': sent,
+            'failed': len(result) - sent,
+            # selected emails, a few selected verifications may share an email
+            'skipped': recipients.order_by().values('email').distinct().count() - pending_emails,
+        },
+        messages.SUCCESS if sent == len(result) else messages.WARNING)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    paginator that uses the PostgreSQL table statistics (pg_class.reltuples) instead of COUNT(*),
+    for unfiltered changelists of large tables.
+    filtered changelists, tables smaller than 'estimate_threshold' rows and other databases use COUNT(*).
+    to always count exact rows, set 'paginator = Paginator' in a ModelAdmin subclass
+    """
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if getattr(queryset, 'query', None) is not None and not queryset.query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                                   [queryset.model._meta.db_table])
+                    row = cursor.fetchone()
+                if row and row[0] >= self.estimate_threshold:
+                    return int(row[0])
+        return super().count
 
 
 @admin.register(User)
-class UserAdmin(UserAdmin):
+class UserAdmin(BaseUserAdmin):
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (_('Personal info'), {'fields': ('first_name', 'last_name', 'gender', 'birth_date', 'language')}),
@@ -21,36 +112,119 @@ class UserAdmin(UserAdmin):
     )
     list_display = ('email', 'first_name', 'last_name', 'is_active', 'is_staff')
     search_fields = ('email', 'first_name', 'last_name')
+    # unique index on email
     ordering = ('email',)
     readonly_fields = ('date_created', 'last_update_date')
-    pass
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('activate_users', 'resend_verification_emails')
+
+    @admin.action(description=_('Activate selected users'))
+    def activate_users(self, request, queryset):
+        activated = _chunked_update(queryset, lambda chunk: chunk.activate())
+        self.message_user(request, _('%(activated)d users activated, %(skipped)d were already active') % {
+            'activated': activated, 'skipped': queryset.count() - activated}, messages.SUCCESS)
+
+    @admin.action(description=_('Resend verification email to selected users'))
+    def resend_verification_emails(self, request, queryset):
+        _resend_verification_emails(self, request, queryset)
+
+
+class VerificationStatusFilter(admin.SimpleListFilter):
+    """
+    filter verifications by status, expiration is calculated by the database (no per object checks)
+    """
+    title = _('status')
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('pending', _('Pending')),
+            ('expired', _('Expired')),
+            ('verified', _('Verified')),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() == 'pending':
+            return queryset.pending()
+        if self.value() == 'expired':
+            return queryset.expired()
+        if self.value() == 'verified':
+            return queryset.verified()
+        return queryset
 
 
 @admin.register(DjangoEmailVerifier)
-class UserAdmin(admin.ModelAdmin):
-    list_display = ('user', 'email', 'is_verified',)
-    list_filter = ('is_verified',)
-    ordering = ('user',)
-    pass
+class DjangoEmailVerifierAdmin(admin.ModelAdmin):
+    list_display = ('user', 'email', 'is_verified', 'date_created')
+    list_filter = (VerificationStatusFilter,)
+    list_select_related = ('user',)
+    search_fields = ('email',)
+    autocomplete_fields = ('user',)
+    # primary key, newest first
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('resend_verification_emails', 'expire_verifications', 'purge_verifications')
+
+    @admin.action(description=_('Resend selected verifications'))
+    def resend_verification_emails(self, request, queryset):
+        _resend_verification_emails(self, request, queryset)
+
+    @admin.action(description=_('Expire selected verifications'))
+    def expire_verifications(self, request, queryset):
+        expired = _chunked_update(queryset, lambda chunk: chunk.expire())
+        self.message_user(request, _('%(expired)d verifications expired, %(skipped)d were not pending') % {
+            'expired': expired, 'skipped': queryset.count() - expired}, messages.SUCCESS)
+
+    @admin.action(description=_('Purge selected verifications (expired and verified)'))
+    def purge_verifications(self, request, queryset):
+        # DjangoEmailVerifier has no relations pointing to it, so each chunk is a single DELETE (no collector)
+        selected = queryset.count()
+        deleted = _chunked_update(queryset, lambda chunk: chunk.purgeable(verified_older_than=0).delete()[0])
+        self.message_user(request, _('%(deleted)d verifications deleted, %(skipped)d pending were kept') % {
+            'deleted': deleted, 'skipped': selected - deleted}, messages.SUCCESS)
 
 
 @admin.register(UserAddress)
-class UserAdmin(admin.ModelAdmin):
+class UserAddressAdmin(admin.ModelAdmin):
     list_display = (
         'user', 'first_name', 'last_name',
         'street_name', 'street_number', 'city', 'state', 'country', 'zip_code',
         'default_address', 'default_billing_address', 'phone_number')
-    list_filter = ('first_name', 'last_name', 'country',)
-    ordering = ('country', 'city', 'street_name',)
+    list_filter = ('country', 'default_address', 'default_billing_address')
+    list_select_related = ('user', 'phone_number')
+    search_fields = ('user__email', 'first_name', 'last_name', 'city')
+    autocomplete_fields = ('user',)
+    raw_id_fields = ('phone_number',)
+    # primary key, newest first
+    ordering = ('-id',)
     readonly_fields = ('created_at',)
-    pass
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(UserPhoneNumber)
-class UserAdmin(admin.ModelAdmin):
+class UserPhoneNumberAdmin(admin.ModelAdmin):
     list_display = ('number', 'owner', 'verified', 'is_default')
-    list_filter = ('number', 'owner', 'verified', 'is_default')
-    search_fields = ('number', 'owner',)
-    ordering = ('number',)
+    list_filter = ('verified', 'is_default')
+    list_select_related = ('owner',)
+    search_fields = ('number', 'owner__email',)
+    autocomplete_fields = ('owner',)
+    # unique index on (number, owner)
+    ordering = ('number', 'owner')
     readonly_fields = ('created_at', 'verified_status_updated_at',)
-    pass
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('mark_verified',)
+
+    @admin.action(description=_('Mark selected phone numbers as verified'))
+    def mark_verified(self, request, queryset):
+        # same numbers of other owners are unverified, if a number is selected for more than one owner, one wins
+        result = UserPhoneNumber.objects.bulk_mark_verified(queryset.order_by().values_list('owner_id', 'number'),
+                                                            batch_size=ACTION_CHUNK_SIZE)
+        self.message_user(request, _('%(verified)d phone numbers verified, %(conflicts)d conflicts, '
+                                     '%(skipped)d skipped') % {'verified': result['verified'],
+                                                               'conflicts': len(result['conflicts']),
+                                                               'skipped': len(result['skipped'])},
+                          messages.SUCCESS if not result['conflicts'] else messages.WARNING)
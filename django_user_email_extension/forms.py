@@ -1,8 +1,10 @@
 from django.core.exceptions import ValidationError
 from django.forms import Form, ModelForm, TextInput, Select, DateInput, NumberInput, CharField, RadioSelect, ChoiceField
-from phonenumbers import is_valid_number, parse, NumberParseException
+from phonenumber_field.phonenumber import to_python
 
-from django_user_email_extension.models import User, UserAddress, DjangoEmailVerifier
+from django_user_email_extension.models import User, UserAddress, UserPhoneNumber, DjangoEmailVerifier
+from django_user_email_extension.phone_numbers import validate_number
+from django_user_email_extension.validators import postal_code_validator
 
 
 class TokenForm(Form):
@@ -43,17 +45,13 @@ class PhoneNumberVerificationForm(Form):
     def clean(self):
         data = self.cleaned_data
 
-        phone_number = data['country_code'] + data['phone_number']
-        try:
-            phone_number = parse(phone_number, None)
-            if not is_valid_number(phone_number):
-                self.add_error('phone_number', 'Invalid phone number')
-            else:
-                # both values are actually cleaned here
-                self.cleaned_data['country_code'] = phone_number.country_code
-                self.cleaned_data['phone_number'] = phone_number
-        except NumberParseException as e:
-            self.add_error('phone_number', e)
+        result = validate_number(data['country_code'] + data['phone_number'])
+        if result.error:
+            self.add_error('phone_number', result.error)
+        else:
+            # both values are actually cleaned here
+            self.cleaned_data['country_code'] = result.country_code
+            self.cleaned_data['phone_number'] = to_python(result.e164)
 
 
 class UserAddressForm(ModelForm):
@@ -83,19 +81,35 @@ class UserAddressForm(ModelForm):
             'phone_number', 'notes',
         ]
 
-    # this form should also get 'user' instance
-    def __init__(self, user, *args, **kwargs):
+    # this form should also get 'user' instance,
+    # with 'upsert' a new address the user already has is not added again, the existing address is updated instead
+    def __init__(self, user, *args, upsert=False, **kwargs):
         super().__init__(*args, **kwargs)
         self.instance.user = user
+        self.upsert = upsert
 
         # since 'phone_number' field is a foreign key to UserPhoneNumber model, for will allow to choose from all users,
         # make sure the 'phone_number' will have only current users phone numbers
-        self.fields['phone_number'].queryset = user.get_all_phone_numbers()
+        self.fields['phone_number'].queryset = UserPhoneNumber.objects.get_all_phone_numbers_of_user(user=user)
 
     def clean(self):
-        # empty clean function so model will not block a user of attempt to add an already existing address
+        # no call to super().clean() so model will not block a user of attempt to add an already existing address
+        country, zip_code = self.cleaned_data.get('country'), self.cleaned_data.get('zip_code')
+        if country and zip_code is not None:
+            try:
+                postal_code_validator.validate(country, zip_code)
+            except ValidationError as e:
+                self.add_error('zip_code', e)
         return self.cleaned_data
 
+    def save(self, commit=True):
+        if self.upsert and commit and self.instance.pk is None:
+            # the submitted fields (that are not part of the fingerprint) are copied to the existing address
+            self.instance, _ = UserAddress.objects.get_or_create_address(self.instance,
+                                                                         update_fields=self._meta.fields)
+            return self.instance
+        return super().save(commit=commit)
+
 
 class UserProfileForm(ModelForm):
     """
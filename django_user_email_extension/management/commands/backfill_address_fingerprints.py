@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from django_user_email_extension.models import ADDRESS_FINGERPRINT_FIELDS, UserAddress
+
+
+class Command(BaseCommand):
+    help = 'Calculate fingerprints of addresses that were saved before this field existed, ' \
+           'and report users with duplicated addresses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of addresses updated per batch (default 1000).')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            self.stderr.write('--batch-size must be a positive number')
+            return
+
+        updated, last_id = 0, 0
+        while True:
+            addresses = list(UserAddress.objects.filter(fingerprint__isnull=True, id__gt=last_id)
+                             .order_by('id').only('id', *ADDRESS_FINGERPRINT_FIELDS)[:batch_size])
+            if not addresses:
+                break
+            last_id = addresses[-1].id
+
+            for address in addresses:
+                address.fingerprint = address.get_fingerprint()
+            UserAddress.objects.bulk_update(addresses, ['fingerprint'])
+            updated += len(addresses)
+            self.stdout.write('Updated {} addresses'.format(updated))
+
+        duplicates = (UserAddress.objects.filter(fingerprint__isnull=False).values('user', 'fingerprint')
+                      .annotate(addresses=Count('id')).filter(addresses__gt=1).order_by('user'))
+        duplicated_addresses = 0
+        for duplicate in duplicates.iterator():
+            duplicated_addresses += duplicate['addresses'] - 1
+            self.stdout.write('User {} has {} identical addresses'.format(duplicate['user'], duplicate['addresses']))
+
+        self.stdout.write('Done, updated {} addresses, found {} duplicated addresses'.format(
+            updated, duplicated_addresses))
@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from django_user_email_extension.models import UserPhoneNumber
+from django_user_email_extension.phone_numbers import get_number_metadata
+
+
+class Command(BaseCommand):
+    help = 'Calculate carrier and location of phone numbers that were saved before these fields existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of phone numbers updated per batch (default 1000).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of processes used for lookups, 1 to run in current process '
+                                 '(default number of CPUs).')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        workers = options['workers'] or 1
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+        updated, last_id = 0, 0
+        try:
+            while True:
+                rows = list(UserPhoneNumber.objects.filter(carrier__isnull=True, id__gt=last_id)
+                            .order_by('id').values_list('id', 'number')[:batch_size])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                numbers = [str(number) for _, number in rows]
+                if executor:
+                    metadata = executor.map(get_number_metadata, numbers, chunksize=max(1, len(numbers) // workers))
+                else:
+                    metadata = map(get_number_metadata, numbers)
+
+                phone_numbers = [UserPhoneNumber(id=row_id, carrier=carrier, location=location)
+                                 for (row_id, _), (carrier, location) in zip(rows, metadata)]
+                UserPhoneNumber.objects.bulk_update(phone_numbers, ['carrier', 'location'])
+                updated += len(phone_numbers)
+                self.stdout.write('Updated {} phone numbers'.format(updated))
+        finally:
+            if executor:
+                executor.shutdown()
+
+        self.stdout.write('Done, updated {} phone numbers'.format(updated))
@@ -0,0 +1,245 @@
+import csv
+import json
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+from django_countries import countries
+
+from django_user_email_extension.models import User, UserAddress, UserPhoneNumber
+from django_user_email_extension.phone_numbers import validate_number
+from django_user_email_extension.timezones import get_country_timezone, get_timezone_choices
+from django_user_email_extension.utils import chunked
+from django_user_email_extension.validators import postal_code_validator
+
+REQUIRED_FIELDS = ('user', 'phone_number', 'first_name', 'last_name',
+                   'street_name', 'street_number', 'city', 'country', 'zip_code')
+TEXT_FIELDS = ('first_name', 'last_name', 'street_name', 'street_number', 'city', 'state', 'notes')
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+class Command(BaseCommand):
+    help = 'Import user addresses from a CSV (with header) or JSON lines file, streamed in chunks. ' \
+           'Each row has the columns: user (email), phone_number (a number of the user), first_name, last_name, ' \
+           'street_name, street_number, city, state, country, zip_code, and optionally timezone, notes, ' \
+           'default_address and default_billing_address. Rejected rows are written to a JSON lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file, or - for stdin.')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default=None,
+                            help='Input format (default by file extension, csv for stdin).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rows validated and inserted per chunk (default 1000).')
+        parser.add_argument('--rejects', default=None,
+                            help='File of rejected rows and reasons (default <path>.rejects.jsonl).')
+        parser.add_argument('--skip-duplicates', action='store_true',
+                            help='Reject rows of addresses the user already has (same fingerprint).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only validate rows, nothing is inserted.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number')
+
+        path = options['path']
+        input_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        rejects_path = options['rejects'] or '{}.rejects.jsonl'.format('import_addresses' if path == '-' else path)
+
+        self.skip_duplicates = options['skip_duplicates']
+        self.enforce_verified_phone = getattr(settings, 'ENFORCE_USER_ADDRESS_VERIFIED_PHONE', False)
+        self.timezones = {timezone for timezone, _ in get_timezone_choices()}
+        self.max_lengths = {name: UserAddress._meta.get_field(name).max_length for name in TEXT_FIELDS
+                            if UserAddress._meta.get_field(name).max_length}
+
+        input_file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        imported, rejected, processed = 0, 0, 0
+        started = time.monotonic()
+        try:
+            with open(rejects_path, 'w', encoding='utf-8') as rejects_file:
+                for rows in chunked(self.read_rows(input_file, input_format), batch_size):
+                    addresses, rejects = self.build_addresses(rows)
+                    if addresses and not options['dry_run']:
+                        try:
+                            self.insert_addresses(addresses, batch_size)
+                        except DatabaseError as e:
+                            rejects.extend((line, row, str(e)) for line, row, _ in addresses)
+                            addresses = []
+
+                    for line, row, reason in rejects:
+                        rejects_file.write(json.dumps({'line': line, 'row': row, 'reason': reason}) + '\n')
+                    imported += len(addresses)
+                    rejected += len(rejects)
+                    processed += len(rows)
+                    self.stdout.write('Processed {} rows, imported {}, rejected {} ({:.0f} rows/s)'.format(
+                        processed, imported, rejected, processed / max(time.monotonic() - started, 1e-6)))
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+
+        self.stdout.write('Done, {} {} addresses, rejected {} (see {})'.format(
+            'validated' if options['dry_run'] else 'imported', imported, rejected, rejects_path))
+
+    @staticmethod
+    def read_rows(input_file, input_format):
+        """
+        :return: generator of (line, row dict) tuples, the file is read line by line,
+                 line is the number of the row's (last) line in the file, counting the csv header
+        """
+        if input_format == 'csv':
+            reader = csv.DictReader(input_file)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line, text in enumerate(input_file, start=1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError as e:
+                    yield line, {'_error': 'Invalid JSON: {}'.format(e)}
+
+    def build_addresses(self, rows):
+        """
+        validate a chunk of rows, users and phone numbers are fetched with a single query each
+        :param rows: list of (line, row dict) tuples
+        :return: tuple of valid (line, row, UserAddress) list, and rejected (line, row, reason) list
+        """
+        rejects, candidates = [], []
+        for line, row in rows:
+            if not isinstance(row, dict) or '_error' in row:
+                rejects.append((line, row, row.get('_error') if isinstance(row, dict) else 'Row is not an object'))
+                continue
+            row = {key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
+            missing = [name for name in REQUIRED_FIELDS if row.get(name) in (None, '')]
+            if missing:
+                rejects.append((line, row, 'Missing {}'.format(', '.join(missing))))
+                continue
+            reason = self.validate_fields(row)
+            if reason:
+                rejects.append((line, row, reason))
+                continue
+            candidates.append((line, row))
+
+        # zip codes are validated grouped by country
+        valid_zip_codes = postal_code_validator.validate_many((row['country'], row['zip_code'])
+                                                              for _, row in candidates)
+        emails = {User.objects.normalize_email(str(row['user'])) for _, row in candidates}
+        existing_emails = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        numbers = {validate_number(row['phone_number']).e164 for _, row in candidates}
+        phone_numbers = {
+            (owner_id, number.as_e164): (number_id, verified) for number_id, owner_id, number, verified in
+            UserPhoneNumber.objects.filter(owner_id__in=existing_emails, number__in=numbers)
+            .values_list('id', 'owner_id', 'number', 'verified')
+        }
+
+        addresses = []
+        for (line, row), valid_zip_code in zip(candidates, valid_zip_codes):
+            email = User.objects.normalize_email(str(row['user']))
+            phone_number = phone_numbers.get((email, validate_number(row['phone_number']).e164))
+            if email not in existing_emails:
+                reason = 'Unknown user {}'.format(email)
+            elif not valid_zip_code:
+                reason = 'Zip Code \'{}\' is not valid for {}'.format(row['zip_code'], countries.name(row['country']))
+            elif phone_number is None:
+                reason = 'Phone number {} not found for user'.format(row['phone_number'])
+            elif self.enforce_verified_phone and not phone_number[1]:
+                reason = '{} has not been verified.'.format(row['phone_number'])
+            else:
+                addresses.append((line, row, UserAddress(
+                    user_id=email,
+                    phone_number_id=phone_number[0],
+                    first_name=row['first_name'],
+                    last_name=row['last_name'],
+                    street_name=row['street_name'],
+                    street_number=row['street_number'],
+                    city=row['city'],
+                    state=row.get('state') or None,
+                    country=row['country'],
+                    zip_code=row['zip_code'],
+                    timezone=row.get('timezone') or get_country_timezone(row['country']) or 'UTC',
+                    notes=row.get('notes') or '',
+                    default_address=_to_bool(row.get('default_address')),
+                    default_billing_address=_to_bool(row.get('default_billing_address')),
+                )))
+                continue
+            rejects.append((line, row, reason))
+
+        # bulk_create does not call save(), fingerprints are set here
+        for _, _, address in addresses:
+            address.fingerprint = address.get_fingerprint()
+        if self.skip_duplicates and addresses:
+            addresses = self.reject_duplicates(addresses, rejects)
+        return addresses, rejects
+
+    @staticmethod
+    def reject_duplicates(addresses, rejects):
+        """
+        move addresses that users already have (by fingerprint) to rejects, with a single query
+        :return: list of (line, row, UserAddress) that are not duplicates
+        """
+        existing = {(user_id, fingerprint): address_id for address_id, user_id, fingerprint in
+                    UserAddress.objects.filter(user_id__in={address.user_id for _, _, address in addresses},
+                                               fingerprint__in={address.fingerprint for _, _, address in addresses})
+                    .values_list('id', 'user_id', 'fingerprint')}
+        unique_addresses, seen = [], {}
+        for line, row, address in addresses:
+            key = (address.user_id, address.fingerprint)
+            if key in existing:
+                rejects.append((line, row, 'Duplicate of address {}'.format(existing[key])))
+            elif key in seen:
+                rejects.append((line, row, 'Duplicate of line {}'.format(seen[key])))
+            else:
+                seen[key] = line
+                unique_addresses.append((line, row, address))
+        return unique_addresses
+
+    def validate_fields(self, row):
+        """
+        :return: reason string if row is not valid, otherwise None
+        """
+        country = countries.alpha2(row['country'])
+        if not country:
+            return 'Invalid country {}'.format(row['country'])
+        row['country'] = country
+        try:
+            row['zip_code'] = int(row['zip_code'])
+        except (TypeError, ValueError):
+            return 'Invalid zip code {}'.format(row['zip_code'])
+        if row.get('timezone') and row['timezone'] not in self.timezones:
+            return 'Invalid timezone {}'.format(row['timezone'])
+        for name in ('first_name', 'last_name'):
+            if len(str(row[name])) < 2:
+                return '{} is too short'.format(name)
+        for name, max_length in self.max_lengths.items():
+            if len(str(row.get(name) or '')) > max_length:
+                return '{} is longer than {} characters'.format(name, max_length)
+        if validate_number(row['phone_number']).error:
+            return 'Invalid phone number {}'.format(row['phone_number'])
+        return None
+
+    @staticmethod
+    def insert_addresses(addresses, batch_size):
+        """
+        insert a chunk of addresses in a single transaction, keeping a single default (and default billing) address
+        per user, the last default row of a user in the chunk wins over previous rows and existing addresses
+        """
+        addresses = [address for _, _, address in addresses]
+        with transaction.atomic():
+            for field in ('default_address', 'default_billing_address'):
+                defaults = {}
+                for address in addresses:
+                    if getattr(address, field):
+                        if address.user_id in defaults:
+                            setattr(defaults[address.user_id], field, False)
+                        defaults[address.user_id] = address
+                if defaults:
+                    UserAddress.objects.filter(user_id__in=defaults, **{field: True}).update(**{field: False})
+            UserAddress.objects.bulk_create(addresses, batch_size=batch_size)
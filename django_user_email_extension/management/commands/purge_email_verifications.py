@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from django_user_email_extension.models import DjangoEmailVerifier
+
+
+class Command(BaseCommand):
+    help = 'Delete expired (never verified) email verifications, and optionally old verified ones. ' \
+           'Rows are deleted in primary key ranges, so each batch is a single short DELETE statement.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verified-older-than', type=int, default=None, metavar='DAYS',
+                            help='Also delete verified verifications created more than DAYS days ago.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Size of the primary key range deleted per batch (default 1000).')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to sleep between batches (default 0).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the verifications that would be deleted.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            self.stderr.write('--batch-size must be a positive number')
+            return
+
+        purgeable = DjangoEmailVerifier.objects.purgeable(verified_older_than=options['verified_older_than'])
+
+        if options['dry_run']:
+            self.stdout.write('{} email verifications would be deleted'.format(purgeable.count()))
+            return
+
+        bounds = purgeable.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if bounds['min_id'] is None:
+            self.stdout.write('No email verifications to delete')
+            return
+
+        deleted = 0
+        for start in range(bounds['min_id'], bounds['max_id'] + 1, batch_size):
+            # DjangoEmailVerifier has no relations pointing to it, so this is a single DELETE (no collector)
+            batch_deleted, _ = purgeable.filter(id__gte=start, id__lt=start + batch_size).delete()
+            deleted += batch_deleted
+            if options['sleep'] and start + batch_size <= bounds['max_id']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write('Deleted {} email verifications'.format(deleted))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from django_user_email_extension.models import PhoneVerificationCode
+
+
+class Command(BaseCommand):
+    help = 'Delete expired phone verification codes. ' \
+           'Rows are deleted in primary key ranges, so each batch is a single short DELETE statement.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Size of the primary key range deleted per batch (default 1000).')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to sleep between batches (default 0).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the codes that would be deleted.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            self.stderr.write('--batch-size must be a positive number')
+            return
+
+        expired = PhoneVerificationCode.objects.expired()
+
+        if options['dry_run']:
+            self.stdout.write('{} phone verification codes would be deleted'.format(expired.count()))
+            return
+
+        bounds = expired.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if bounds['min_id'] is None:
+            self.stdout.write('No phone verification codes to delete')
+            return
+
+        deleted = 0
+        for start in range(bounds['min_id'], bounds['max_id'] + 1, batch_size):
+            # PhoneVerificationCode has no relations pointing to it, so this is a single DELETE (no collector)
+            batch_deleted, _ = expired.filter(id__gte=start, id__lt=start + batch_size).delete()
+            deleted += batch_deleted
+            if options['sleep'] and start + batch_size <= bounds['max_id']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write('Deleted {} phone verification codes'.format(deleted))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from django_user_email_extension.models import EmailOutbox
+
+
+class Command(BaseCommand):
+    help = 'Send emails stored in the email outbox, using a bounded pool of threads (one mail connection each).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of emails claimed per batch (default 100).')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of sending threads, and mail connections (default 4).')
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Attempts before an email is marked as failed (default 5).')
+        parser.add_argument('--backoff', type=int, default=60,
+                            help='Seconds to wait before the first retry, doubled on every retry (default 60).')
+        parser.add_argument('--sleep', type=float, default=5,
+                            help='Seconds to wait when there is nothing to send (default 5).')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no more emails ready to be sent.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            self.stderr.write('--batch-size and --workers must be positive numbers')
+            return
+
+        while True:
+            result = EmailOutbox.objects.send_pending(batch_size=options['batch_size'],
+                                                      workers=options['workers'],
+                                                      max_attempts=options['max_attempts'],
+                                                      backoff_seconds=options['backoff'])
+            if any(result.values()):
+                self.stdout.write('Sent {sent}, will retry {retry}, failed {failed}'.format(**result))
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['sleep'])
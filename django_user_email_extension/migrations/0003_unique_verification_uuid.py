@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:04
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0002_auto_20210814_1256'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='djangoemailverifier',
+            name='verification_uuid',
+            field=models.UUIDField(default=uuid.uuid4, unique=True, verbose_name='Unique Verification UUID'),
+        ),
+    ]
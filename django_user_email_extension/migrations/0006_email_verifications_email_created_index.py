@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0005_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='djangoemailverifier',
+            index=models.Index(fields=['email', 'date_created'], name='email_verif_email_created'),
+        ),
+    ]
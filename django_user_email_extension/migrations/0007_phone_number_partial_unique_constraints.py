@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:11
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+BATCH_SIZE = 1000
+
+
+def _reset_duplicates(queryset, group_field, keep_ordering, reset):
+    """
+    for each value of 'group_field' having more than one row in 'queryset', keep the first row (by 'keep_ordering'),
+    and apply 'reset' update on the rest, in batches of BATCH_SIZE duplicated values
+    """
+    duplicated = (queryset.values(group_field).annotate(rows=Count('id')).filter(rows__gt=1)
+                  .order_by(group_field).values_list(group_field, flat=True))
+    while True:
+        values = list(duplicated[:BATCH_SIZE])
+        if not values:
+            return
+        kept, reset_ids = set(), []
+        rows = queryset.filter(**{group_field + '__in': values}).order_by(group_field, *keep_ordering)
+        for row_id, value in rows.values_list('id', group_field):
+            if value in kept:
+                reset_ids.append(row_id)
+            kept.add(value)
+        queryset.model.objects.filter(id__in=reset_ids).update(**reset)
+
+
+def deduplicate_phone_numbers(apps, schema_editor):
+    UserPhoneNumber = apps.get_model('django_user_email_extension', 'UserPhoneNumber')
+    # most recently verified row of a number stays verified
+    _reset_duplicates(UserPhoneNumber.objects.filter(verified=True),
+                      'number',
+                      (F('verified_status_updated_at').desc(nulls_last=True), '-id'),
+                      {'verified': False})
+    # newest default row of an owner stays default
+    _reset_duplicates(UserPhoneNumber.objects.filter(is_default=True), 'owner_id', ('-id',), {'is_default': False})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0006_email_verifications_email_created_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_phone_numbers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userphonenumber',
+            constraint=models.UniqueConstraint(condition=models.Q(('verified', True)), fields=('number',), name='unique_verified_phone_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='userphonenumber',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_default', True)), fields=('owner',), name='unique_default_phone_number'),
+        ),
+    ]
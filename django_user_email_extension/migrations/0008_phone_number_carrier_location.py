@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0007_phone_number_partial_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userphonenumber',
+            name='carrier',
+            field=models.CharField(blank=True, editable=False, max_length=128, null=True, verbose_name='Carrier'),
+        ),
+        migrations.AddField(
+            model_name='userphonenumber',
+            name='location',
+            field=models.CharField(blank=True, editable=False, max_length=128, null=True, verbose_name='Location'),
+        ),
+    ]
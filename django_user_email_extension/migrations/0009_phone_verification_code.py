@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0008_phone_number_carrier_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhoneVerificationCode',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('code_hash', models.CharField(editable=False, max_length=128)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date Created')),
+                ('expires_at', models.DateTimeField()),
+                ('phone_number', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='verification_codes', to='django_user_email_extension.userphonenumber')),
+            ],
+            options={
+                'db_table': 'phone_verification_codes',
+                'verbose_name': 'Phone Verification Code',
+                'verbose_name_plural': 'Phone Verification Codes',
+                'indexes': [models.Index(fields=['phone_number', 'expires_at'], name='phone_verif_number_expires')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:21
+
+import django_user_email_extension.timezones
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0009_phone_verification_code'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useraddress',
+            name='timezone',
+            field=models.CharField(blank=True, choices=django_user_email_extension.timezones.get_timezone_choices, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:24
+
+from django.db import migrations, models
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def _reset_duplicates(queryset, group_field, keep_ordering, reset):
+    """
+    for each value of 'group_field' having more than one row in 'queryset', keep the first row (by 'keep_ordering'),
+    and apply 'reset' update on the rest, in batches of BATCH_SIZE duplicated values
+    """
+    duplicated = (queryset.values(group_field).annotate(rows=Count('id')).filter(rows__gt=1)
+                  .order_by(group_field).values_list(group_field, flat=True))
+    while True:
+        values = list(duplicated[:BATCH_SIZE])
+        if not values:
+            return
+        kept, reset_ids = set(), []
+        rows = queryset.filter(**{group_field + '__in': values}).order_by(group_field, *keep_ordering)
+        for row_id, value in rows.values_list('id', group_field):
+            if value in kept:
+                reset_ids.append(row_id)
+            kept.add(value)
+        queryset.model.objects.filter(id__in=reset_ids).update(**reset)
+
+
+def deduplicate_default_addresses(apps, schema_editor):
+    UserAddress = apps.get_model('django_user_email_extension', 'UserAddress')
+    # newest default address of a user stays default
+    _reset_duplicates(UserAddress.objects.filter(default_address=True), 'user_id', ('-id',),
+                      {'default_address': False})
+    _reset_duplicates(UserAddress.objects.filter(default_billing_address=True), 'user_id', ('-id',),
+                      {'default_billing_address': False})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0010_lazy_address_timezone_choices'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_default_addresses, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='useraddress',
+            constraint=models.UniqueConstraint(condition=models.Q(('default_address', True)), fields=('user',), name='unique_default_address'),
+        ),
+        migrations.AddConstraint(
+            model_name='useraddress',
+            constraint=models.UniqueConstraint(condition=models.Q(('default_billing_address', True)), fields=('user',), name='unique_default_billing_address'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0011_address_default_partial_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useraddress',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='useraddress',
+            index=models.Index(fields=['user', 'fingerprint'], name='user_address_fingerprint'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_user_email_extension', '0012_address_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='djangoemailverifier',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,22 +1,88 @@
+import enum
+import hashlib
 import re
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime, timezone
 
-import pytz
 from django.conf import settings
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser, PermissionsMixin
 from django.core.exceptions import ValidationError
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.core.validators import MinLengthValidator
 from django.core.validators import validate_email
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Coalesce, Now
+from django.utils.crypto import constant_time_compare, get_random_string, salted_hmac
 from django.utils.translation import gettext_lazy as _
 from django_countries.fields import CountryField
 from phonenumber_field.modelfields import PhoneNumberField
+from phonenumber_field.phonenumber import to_python
 
 from django_user_email_extension.languages import LANGUAGES
-from django_user_email_extension.validators import validate_users_min_age, validate_alphabetic_string
-from . import ZIP_CODES_REGEX
+from django_user_email_extension.phone_numbers import get_number_carrier, get_number_location, get_number_metadata
+from django_user_email_extension.sms_backends import get_sms_backend
+from django_user_email_extension.throttling import check_resend_throttle
+from django_user_email_extension.timezones import get_country_timezone, get_timezone_choices
+from django_user_email_extension.utils import chunked
+from django_user_email_extension.validators import postal_code_validator, validate_users_min_age, \
+    validate_alphabetic_string
+
+
+def utc_now():
+    return datetime.now(tz=timezone.utc)
+
+
+# address fields compared by fingerprint
+ADDRESS_FINGERPRINT_FIELDS = ('street_name', 'street_number', 'city', 'zip_code', 'country')
+
+_NON_ALPHANUMERIC_REGEX = re.compile(r'[\W_]+')
+
+
+def address_fingerprint(street_name, street_number, city, zip_code, country):
+    """
+    return a fingerprint of an address, equal for addresses that differ only in case, whitespace and punctuation
+    :return: sha256 hex string
+    """
+    normalised = '|'.join(_NON_ALPHANUMERIC_REGEX.sub(' ', str(value or '')).strip().casefold()
+                          for value in (street_name, street_number, city, zip_code, country))
+    return hashlib.sha256(normalised.encode()).hexdigest()
+
+
+def _validate_constraints_except(instance, skipped, exclude=None):
+    """
+    same as Model.validate_constraints(), without the constraints named in 'skipped'.
+    used for flags that save() swaps (unsets the flag of the other row first), so a form should not reject them,
+    the constraints are still enforced by the database
+    """
+    using = router.db_for_write(instance.__class__, instance=instance)
+    errors = {}
+    for model_class, model_constraints in instance.get_constraints():
+        for constraint in model_constraints:
+            if constraint.name in skipped:
+                continue
+            try:
+                constraint.validate(model_class, instance, exclude=exclude, using=using)
+            except ValidationError as e:
+                if getattr(e, 'code', None) == 'unique' and len(constraint.fields) == 1:
+                    errors.setdefault(constraint.fields[0], []).append(e)
+                else:
+                    errors = e.update_error_dict(errors)
+    if errors:
+        raise ValidationError(errors)
+
+
+def _to_phone_number(value, region=None):
+    """
+    convert raw input to a PhoneNumber object
+    :param region: region code (eg 'US') for numbers without country code, or None
+    :return: PhoneNumber object, or None if not a valid number
+    """
+    try:
+        number = to_python(value, region=region)
+    except TypeError:
+        return None
+    return number if number and number.is_valid() else None
 
 
 class PhoneNumberManager(models.Manager):
@@ -45,10 +111,7 @@ class PhoneNumberManager(models.Manager):
         :param user: User object
         :return: list of PhoneNumberField
         """
-        result = []
-        for phone_object in self.get_verified_phone_numbers_of_user(user=user):
-            result.append(phone_object.number)
-        return result
+        return list(self.get_verified_phone_numbers_of_user(user=user).values_list('number', flat=True))
 
     def get_default_number_of_user(self, user):
         """
@@ -62,6 +125,199 @@ class PhoneNumberManager(models.Manager):
         except UserPhoneNumber.DoesNotExist:
             return None
 
+    def get_owner_of_verified_number(self, number, region=None):
+        """
+        return the user that verified a number (there can be 0 or max 1)
+        :param number: raw number input, or PhoneNumber object, normalised to E.164 before querying
+        :param region: region code (eg 'US') for numbers without country code, or None
+        :return: User object, or None if number is invalid or not verified by any user
+        """
+        number = _to_phone_number(number, region=region)
+        if number is None:
+            return None
+        try:
+            return self.select_related('owner').get(number=number, verified=True).owner
+        except UserPhoneNumber.DoesNotExist:
+            return None
+
+    def owners_of_numbers(self, numbers, region=None):
+        """
+        return the users that verified numbers, with a single query
+        :param numbers: iterable of raw number inputs, or PhoneNumber objects
+        :param region: region code (eg 'US') for numbers without country code, or None
+        :return: dict of E.164 number string -> User object, invalid and not verified numbers are not included
+        """
+        e164_numbers = set()
+        for number in numbers:
+            number = _to_phone_number(number, region=region)
+            if number is not None:
+                e164_numbers.add(number.as_e164)
+        if not e164_numbers:
+            return {}
+        return {phone_number.number.as_e164: phone_number.owner for phone_number in
+                self.select_related('owner').filter(number__in=e164_numbers, verified=True)}
+
+    def bulk_import(self, rows, batch_size=1000):
+        """
+        create many phone numbers, keeping single 'verified=True' per 'number' and single 'is_default=True' per 'owner',
+        with set based UPDATEs and a single INSERT per batch (each batch in its own transaction), save() is not called.
+        inside a batch, the last row of a number (or owners default) wins, same as saving rows one by one would.
+        :param rows: iterable of dicts with 'owner' (User object or email), 'number',
+                     and optional 'verified' and 'is_default' booleans
+        :param batch_size: number of rows per batch
+        :return: dict with 'created' count, 'skipped' and 'conflicts' lists of (row, reason),
+                 existing numbers of other owners that were unverified are reported as conflicts
+                 of ((id, owner_id, number), reason)
+        """
+        result = {'created': 0, 'skipped': [], 'conflicts': []}
+        for batch in chunked(rows, batch_size):
+            with transaction.atomic():
+                self._bulk_import_batch(batch, result)
+        return result
+
+    def _bulk_import_batch(self, batch, result):
+        now = utc_now()
+        parsed = {}
+        for row in batch:
+            number = _to_phone_number(row.get('number'))
+            if number is None:
+                result['skipped'].append((row, 'invalid number'))
+                continue
+            key = (getattr(row.get('owner'), 'pk', row.get('owner')), number.as_e164)
+            if key in parsed:
+                result['skipped'].append((row, 'duplicate row'))
+                continue
+            parsed[key] = (row, number)
+
+        owner_ids = {owner_id for owner_id, _ in parsed}
+        numbers = {e164 for _, e164 in parsed}
+        existing_owners = set(User.objects.filter(pk__in=owner_ids).values_list('pk', flat=True))
+        existing_pairs = {(owner_id, number.as_e164) for owner_id, number in
+                          self.filter(owner_id__in=owner_ids, number__in=numbers).values_list('owner_id', 'number')}
+
+        objects = {}
+        for key, (row, number) in parsed.items():
+            if key[0] not in existing_owners:
+                result['skipped'].append((row, 'unknown owner'))
+            elif key in existing_pairs:
+                result['skipped'].append((row, 'number already exists for owner'))
+            else:
+                carrier, location = get_number_metadata(number.as_e164)
+                objects[key] = (row, self.model(owner_id=key[0],
+                                                number=number,
+                                                verified=bool(row.get('verified')),
+                                                is_default=bool(row.get('is_default')),
+                                                carrier=carrier,
+                                                location=location))
+
+        # last row wins, earlier rows of the same verified number / owners default are reset
+        verified_by_number, default_by_owner = {}, {}
+        for (owner_id, e164), (row, phone_number) in objects.items():
+            if phone_number.verified:
+                if e164 in verified_by_number:
+                    previous_row, previous = verified_by_number[e164]
+                    previous.verified = False
+                    result['conflicts'].append((previous_row, 'number verified by another row'))
+                verified_by_number[e164] = (row, phone_number)
+            if phone_number.is_default:
+                if owner_id in default_by_owner:
+                    previous_row, previous = default_by_owner[owner_id]
+                    previous.is_default = False
+                    result['conflicts'].append((previous_row, 'owner has another default row'))
+                default_by_owner[owner_id] = (row, phone_number)
+
+        if verified_by_number:
+            self._unverify_numbers(self.filter(number__in=verified_by_number.keys()), now, result)
+        if default_by_owner:
+            self.filter(owner_id__in=default_by_owner.keys(), is_default=True).update(is_default=False)
+
+        # owners with a verified number and no default number get their (first) verified number as default
+        verified_owners = {phone_number.owner_id for _, phone_number in verified_by_number.values()}
+        owners_with_default = set(default_by_owner) | set(self.filter(
+            owner_id__in=verified_owners - set(default_by_owner), is_default=True).values_list('owner_id', flat=True))
+        for row, phone_number in verified_by_number.values():
+            if phone_number.owner_id not in owners_with_default:
+                phone_number.is_default = True
+                owners_with_default.add(phone_number.owner_id)
+            phone_number.verified_status_updated_at = now
+
+        self.bulk_create([phone_number for _, phone_number in objects.values()])
+        result['created'] += len(objects)
+
+    def _unverify_numbers(self, queryset, now, result):
+        """
+        unverify the verified numbers of queryset (numbers now verified by other owners) with a single UPDATE,
+        each unverified number is added to result['conflicts']
+        """
+        rows = list(queryset.select_for_update().filter(verified=True).values_list('id', 'owner_id', 'number'))
+        if not rows:
+            return
+        self.filter(id__in=[row_id for row_id, _, _ in rows]).update(verified=False, verified_status_updated_at=now)
+        result['conflicts'].extend(((row_id, owner_id, number.as_e164), 'verified number of another owner unverified')
+                                   for row_id, owner_id, number in rows)
+
+    def bulk_mark_verified(self, pairs, batch_size=1000):
+        """
+        mark many existing phone numbers as verified, with set based UPDATEs (each batch in its own transaction),
+        the same numbers of other owners are unverified, and owners without a default number get the verified one.
+        inside a batch, if a number is paired with more than one owner, the last pair wins.
+        :param pairs: iterable of (owner, number) tuples, owner is a User object or email
+        :param batch_size: number of pairs per batch
+        :return: dict with 'verified' count, 'skipped' and 'conflicts' lists of (pair, reason),
+                 existing numbers of other owners that were unverified are reported as conflicts
+                 of ((id, owner_id, number), reason)
+        """
+        result = {'verified': 0, 'skipped': [], 'conflicts': []}
+        for batch in chunked(pairs, batch_size):
+            with transaction.atomic():
+                self._bulk_mark_verified_batch(batch, result)
+        return result
+
+    def _bulk_mark_verified_batch(self, batch, result):
+        now = utc_now()
+        owner_by_number = {}
+        for pair in batch:
+            owner, number = pair
+            number = _to_phone_number(number)
+            if number is None:
+                result['skipped'].append((pair, 'invalid number'))
+                continue
+            if number.as_e164 in owner_by_number:
+                result['conflicts'].append((owner_by_number[number.as_e164][1], 'number verified by another pair'))
+            owner_by_number[number.as_e164] = (getattr(owner, 'pk', owner), pair)
+
+        rows = self.filter(number__in=owner_by_number.keys(),
+                           owner_id__in={owner_id for owner_id, _ in owner_by_number.values()}
+                           ).values_list('id', 'owner_id', 'number', 'verified')
+        rows = {(owner_id, number.as_e164): (row_id, verified) for row_id, owner_id, number, verified in rows}
+
+        targets, unverified_ids = {}, []
+        for e164, (owner_id, pair) in owner_by_number.items():
+            if (owner_id, e164) not in rows:
+                result['skipped'].append((pair, 'number not found for owner'))
+                continue
+            row_id, verified = rows[(owner_id, e164)]
+            targets[row_id] = owner_id
+            if not verified:
+                unverified_ids.append(row_id)
+        if not targets:
+            return
+
+        self._unverify_numbers(self.filter(number__in=owner_by_number.keys()).exclude(id__in=targets.keys()),
+                               now, result)
+        self.filter(id__in=unverified_ids).update(verified=True, verified_status_updated_at=now)
+        result['verified'] += len(targets)
+
+        # owners without a default number, get one of the verified numbers as default
+        owners_with_default = set(self.filter(owner_id__in=set(targets.values()),
+                                              is_default=True).values_list('owner_id', flat=True))
+        default_ids = {}
+        for row_id, owner_id in targets.items():
+            if owner_id not in owners_with_default:
+                default_ids.setdefault(owner_id, row_id)
+        if default_ids:
+            self.filter(id__in=default_ids.values()).update(is_default=True)
+
 
 class UserPhoneNumber(models.Model):
     id = models.AutoField(primary_key=True)
@@ -73,7 +329,6 @@ class UserPhoneNumber(models.Model):
         default=False,
         help_text=_('Define if this number have been verified.'),
     )
-    __original_verified = None
     is_default = models.BooleanField(
         _('Default Status'),
         default=False,
@@ -85,46 +340,99 @@ class UserPhoneNumber(models.Model):
     created_at = models.DateTimeField(_('Date Created'), auto_now_add=True, null=True, blank=True)
     verified_status_updated_at = models.DateTimeField(null=True, editable=False)
 
+    # calculated when number is saved, null if not calculated yet (see 'backfill_phone_number_metadata' command)
+    carrier = models.CharField(_('Carrier'), max_length=128, null=True, blank=True, editable=False)
+    location = models.CharField(_('Location'), max_length=128, null=True, blank=True, editable=False)
+
     objects = PhoneNumberManager()
 
     class Meta:
         db_table = 'user_phone_numbers'
         constraints = [
-            models.UniqueConstraint(fields=['number', 'owner'], name='unique_users_phone_number')
+            models.UniqueConstraint(fields=['number', 'owner'], name='unique_users_phone_number'),
+            models.UniqueConstraint(fields=['number'], condition=models.Q(verified=True),
+                                    name='unique_verified_phone_number'),
+            models.UniqueConstraint(fields=['owner'], condition=models.Q(is_default=True),
+                                    name='unique_default_phone_number'),
         ]
         verbose_name = _('User Phone Numbers')
         verbose_name_plural = _('User Phone Numbers')
 
     def __init__(self, *args, **kwargs):
         super(UserPhoneNumber, self).__init__(*args, **kwargs)
-        self.__original_verified = self.verified
-
-    def save(self, *args, **kwargs):
-        # check if there is a change is the verified field
-        if self.verified != self.__original_verified:
-            # update timestamp
-            self.verified_status_updated_at = datetime.now(tz=timezone.utc)
+        self.__original_values = self._get_loaded_values()
 
-        # check there is no other same number(s) (from another owner) which are also verified,
-        # if there are any, set all of them to False, so there is a unique number with `verified=True`,
-        # allow exactly single 'verified=True' value per 'number'
-        if self.verified:
-            UserPhoneNumber.objects.filter(number=self.number, verified=True).update(verified=False)
+    def validate_constraints(self, exclude=None):
+        # save() swaps 'verified' and 'is_default' between rows
+        _validate_constraints_except(self, {'unique_verified_phone_number', 'unique_default_phone_number'},
+                                     exclude=exclude)
 
-            # if current owner still does not have any default number (first time a number is saved),
-            # this under verified if statement since only verified number should be able default.
-            if not UserPhoneNumber.objects.filter(owner=self.owner, is_default=True):
-                self.is_default = True
+    def _get_loaded_values(self):
+        # deferred fields are not in __dict__, and should not be loaded here
+        return {field.attname: self.__dict__[field.attname]
+                for field in self._meta.concrete_fields if field.attname in self.__dict__}
 
-        # check are no multiple numbers, for the same owner (user) which are `is_default=True`,
-        # if there are any, set all of them to False, so there is a unique number (per user) with `is_default=True`.
-        # allow exactly single 'is_default=True' value per 'owner'
-        if self.is_default:
-            UserPhoneNumber.objects.filter(owner=self.owner, is_default=True).update(is_default=False)
+    def _get_changed_fields(self):
+        return [attname for attname, value in self._get_loaded_values().items()
+                if attname != 'id' and (attname not in self.__original_values or self.__original_values[attname] != value)]
 
-        # save new verified state to __original_verified for future checks
-        self.__original_verified = self.verified
-        super(UserPhoneNumber, self).save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        """
+        save the number, allowing exactly single 'verified=True' per 'number', and single 'is_default=True' per 'owner'.
+        both rules are enforced by the database (partial unique constraints), save() only swaps the flag,
+        in a single transaction, and issues at most 4 queries:
+        1. UPDATE of the verified row with the same number to 'verified=False' (only when number becomes verified)
+        2. SELECT of owners default number existence (only when number becomes verified, and is not default)
+        3. UPDATE of the default row of the owner to 'is_default=False' (only when number becomes default)
+        4. INSERT, or UPDATE of changed columns only (no query if nothing changed)
+        """
+        now = utc_now()
+        original = self.__original_values
+        adding = self._state.adding
+        # check if there is a change is the verified field
+        if self.verified != original.get('verified', self.verified) or (adding and self.verified):
+            # update timestamp
+            self.verified_status_updated_at = now
+
+        metadata_changed = adding or self.carrier is None or self.number != original.get('number', self.number)
+        if metadata_changed:
+            self.carrier, self.location = get_number_metadata(str(self.number))
+
+        becomes_verified = self.verified and (adding or not original.get('verified', True) or
+                                              self.number != original.get('number', self.number))
+        becomes_default = self.is_default and (adding or not original.get('is_default', True) or
+                                               self.owner_id != original.get('owner_id', self.owner_id))
+
+        with transaction.atomic():
+            if becomes_verified:
+                # allow exactly single 'verified=True' value per 'number', other owners numbers are unverified
+                UserPhoneNumber.objects.filter(number=self.number, verified=True).exclude(
+                    id=self.pk).update(verified=False, verified_status_updated_at=now)
+
+                # if current owner still does not have any default number (first time a number is saved),
+                # only verified number should be able default.
+                if not self.is_default and not UserPhoneNumber.objects.filter(owner=self.owner_id,
+                                                                              is_default=True).exists():
+                    self.is_default = becomes_default = True
+
+            if becomes_default:
+                # allow exactly single 'is_default=True' value per 'owner'
+                UserPhoneNumber.objects.filter(owner=self.owner_id, is_default=True).exclude(
+                    id=self.pk).update(is_default=False)
+
+            # on update, write changed columns only
+            if not adding and not kwargs.get('force_insert'):
+                changed_fields = self._get_changed_fields()
+                if kwargs.get('update_fields') is not None:
+                    # fields changed here, in addition to fields requested by the caller
+                    changed_fields = set(kwargs['update_fields']).union(
+                        set(changed_fields) & {'is_default', 'verified_status_updated_at'})
+                    if metadata_changed:
+                        changed_fields |= {'carrier', 'location'}
+                kwargs['update_fields'] = changed_fields
+            super(UserPhoneNumber, self).save(*args, **kwargs)
+
+        self.__original_values = self._get_loaded_values()
 
     def __str__(self):
         return str(self.number)
@@ -132,23 +440,144 @@ class UserPhoneNumber(models.Model):
     def get_mobile_number_carrier(self):
         """
         get numbers mobile carrier, return empty string is not found.
+        (the carrier is also stored in 'carrier' field when number is saved)
         :return: string
         """
-        from phonenumbers import carrier, parse
-        number = parse(str(self.number))
-        return carrier.name_for_number(number, "en")
+        return get_number_carrier(str(self.number))
 
     def get_number_location_description(self):
         """
         return a text description of a PhoneNumber object, return empty string is not found.
+        (the description is also stored in 'location' field when number is saved)
         :return: string
         """
-        from phonenumbers import geocoder, parse
-        return geocoder.description_for_number(parse(str(self.number)), "en")
+        return get_number_location(str(self.number))
+
+    def send_verification_code(self):
+        """
+        send a verification code to the number by sms, previous codes of the number can not be used anymore
+        :return: number of messages sent (0 or 1)
+        """
+        return PhoneVerificationCode.objects.send_codes([self])
+
+    def verify_code(self, code):
+        """
+        check a verification code sent to the number, if valid the number is marked as verified
+        :param code: code string entered by the user
+        :return: PhoneVerificationResult
+        """
+        return PhoneVerificationCode.objects.check_code(self, code)
+
+
+class PhoneVerificationCodeQuerySet(models.QuerySet):
+
+    def expired(self):
+        return self.filter(expires_at__lte=utc_now())
+
+
+class PhoneVerificationResult(enum.Enum):
+    VERIFIED = 'verified'
+    INVALID = 'invalid'
+    EXPIRED = 'expired'
+    TOO_MANY_ATTEMPTS = 'too_many_attempts'
+    UNKNOWN = 'unknown'
+
+
+class PhoneVerificationCodeManager(models.Manager.from_queryset(PhoneVerificationCodeQuerySet)):
+    salt = 'django_user_email_extension.models.PhoneVerificationCode'
+
+    def _hash_code(self, phone_number_id, code):
+        # codes are short, binding the hash to the number prevents reusing a hash of another number
+        return salted_hmac(self.salt, '{}:{}'.format(phone_number_id, code)).hexdigest()
+
+    def send_codes(self, phone_numbers, batch_size=500):
+        """
+        create a new code for each number (previous codes of the numbers are deleted), and send the codes by sms.
+        each batch is a single DELETE, a single INSERT and a single call to the sms backend.
+        code length, expiry (in minutes) and message are set by PHONE_VERIFICATION_CODE_LENGTH (default 6),
+        PHONE_VERIFICATION_EXPIRE_TIME (default 10) and PHONE_VERIFICATION_MESSAGE (default 'Your code is {code}')
+        :param phone_numbers: iterable of UserPhoneNumber objects
+        :param batch_size: number of codes created and sent at once
+        :return: number of messages sent
+        """
+        length = getattr(settings, 'PHONE_VERIFICATION_CODE_LENGTH', 6)
+        expires_at = utc_now() + timedelta(minutes=getattr(settings, 'PHONE_VERIFICATION_EXPIRE_TIME', 10))
+        message = getattr(settings, 'PHONE_VERIFICATION_MESSAGE', 'Your code is {code}')
+        backend = get_sms_backend()
+
+        sent = 0
+        for batch in chunked(phone_numbers, batch_size):
+            # a single code per number
+            batch = {phone_number.id: phone_number for phone_number in batch}
+            codes = {phone_number_id: get_random_string(length, allowed_chars='0123456789')
+                     for phone_number_id in batch}
+            with transaction.atomic(using=self.db):
+                self.filter(phone_number_id__in=batch).delete()
+                self.bulk_create([PhoneVerificationCode(phone_number_id=phone_number_id,
+                                                        code_hash=self._hash_code(phone_number_id, code),
+                                                        expires_at=expires_at)
+                                  for phone_number_id, code in codes.items()])
+            sent += backend.send_messages([(batch[phone_number_id].number.as_e164, message.format(code=code))
+                                           for phone_number_id, code in codes.items()])
+        return sent
+
+    def check_code(self, phone_number, code):
+        """
+        check a code sent to a number, hashes are compared in constant time.
+        every check is counted as an attempt (with a conditional UPDATE, so concurrent checks can not exceed the limit),
+        the code can not be used after PHONE_VERIFICATION_MAX_ATTEMPTS attempts (default 5).
+        on success the codes of the number are deleted, and the number is saved as verified
+        :param phone_number: UserPhoneNumber object
+        :param code: code string entered by the user
+        :return: PhoneVerificationResult
+        """
+        verification = self.filter(phone_number=phone_number).order_by('-expires_at').first()
+        if verification is None:
+            return PhoneVerificationResult.UNKNOWN
+        if verification.expires_at <= utc_now():
+            return PhoneVerificationResult.EXPIRED
+
+        max_attempts = getattr(settings, 'PHONE_VERIFICATION_MAX_ATTEMPTS', 5)
+        if not self.filter(id=verification.id, attempts__lt=max_attempts).update(attempts=models.F('attempts') + 1):
+            return PhoneVerificationResult.TOO_MANY_ATTEMPTS
+        if not constant_time_compare(self._hash_code(phone_number.id, code), verification.code_hash):
+            return PhoneVerificationResult.INVALID
+
+        with transaction.atomic(using=self.db):
+            deleted, _ = self.filter(phone_number=phone_number).delete()
+            if not deleted:
+                # code was used by a concurrent check
+                return PhoneVerificationResult.UNKNOWN
+            phone_number.verified = True
+            phone_number.save()
+        return PhoneVerificationResult.VERIFIED
+
+
+class PhoneVerificationCode(models.Model):
+    id = models.AutoField(primary_key=True)
+    # indexed by 'phone_verif_number_expires' (phone_number is its first column)
+    phone_number = models.ForeignKey(UserPhoneNumber, on_delete=models.CASCADE, related_name='verification_codes',
+                                     db_index=False)
+    code_hash = models.CharField(max_length=128, editable=False)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(_('Date Created'), auto_now_add=True, blank=True, editable=False)
+    expires_at = models.DateTimeField()
+
+    objects = PhoneVerificationCodeManager()
+
+    class Meta:
+        db_table = 'phone_verification_codes'
+        verbose_name = _('Phone Verification Code')
+        verbose_name_plural = _('Phone Verification Codes')
+        indexes = [
+            models.Index(fields=['phone_number', 'expires_at'], name='phone_verif_number_expires'),
+        ]
+
+    def __str__(self):
+        return 'Code for: {}'.format(self.phone_number_id)
 
 
 class AbstractAddress(models.Model):
-    TIMEZONES = tuple(zip(pytz.all_timezones, pytz.all_timezones))
     id = models.AutoField(primary_key=True)
 
     first_name = models.CharField(_("First name"), max_length=128, validators=[MinLengthValidator(2)])
@@ -164,9 +593,12 @@ class AbstractAddress(models.Model):
     # uses https://github.com/SmileyChris/django-countries#countryfield
     country = CountryField(_('Country'))
     zip_code = models.IntegerField(_('Zip code'))
-    timezone = models.CharField(max_length=32, choices=TIMEZONES, default='UTC')
+    # if not set, the timezone of the country is set on save (UTC for countries with more than one timezone)
+    timezone = models.CharField(max_length=32, choices=get_timezone_choices, blank=True, default='')
 
     created_at = models.DateTimeField(_('Date Created'), auto_now_add=True, blank=True, editable=False)
+    # calculated on save, see address_fingerprint(), null for addresses saved before this field existed
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     class Meta:
         abstract = True
@@ -191,25 +623,101 @@ class AbstractAddress(models.Model):
         # validate zip code is valid for country
         self.validate_zip_code_is_valid_country()
 
+    def get_fingerprint(self):
+        return address_fingerprint(*(getattr(self, field) for field in ADDRESS_FINGERPRINT_FIELDS))
+
+    def save(self, *args, **kwargs):
+        if not self.timezone:
+            self.timezone = get_country_timezone(self.country) or 'UTC'
+        self.fingerprint = self.get_fingerprint()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(ADDRESS_FINGERPRINT_FIELDS):
+            kwargs['update_fields'] = set(update_fields) | {'fingerprint'}
+        super(AbstractAddress, self).save(*args, **kwargs)
+
     def validate_zip_code_is_valid_country(self):
         """
         validate zip code is valid code for input country code
         """
-        country_code = self.country
-
-        # cast integer zip code to string
-        zip_code = str(self.zip_code)
-        regex = ZIP_CODES_REGEX.get(country_code, None)
-
-        # Validate postcode against regex for the country if available
-        if regex and not re.match(regex, zip_code):
-            raise ValidationError(message='Zip Code \'{}\' is not valid for {}'.format(zip_code, self.country.name))
+        # missing zip code is reported by field validation
+        if self.zip_code is not None:
+            postal_code_validator.validate(self.country, self.zip_code)
 
 
 class UserAddressManager(models.Manager):
     def get_all_user_addresses(self, user):
         return self.all().filter(user=user)
 
+    def _clear_default(self, field, user, exclude_id=None):
+        """
+        set 'field' to False on the users default address (there can be 0 or max 1), except 'exclude_id'
+        """
+        self.filter(user=user, **{field: True}).exclude(id=exclude_id).update(**{field: False})
+
+    def _set_default(self, field, user, address_id):
+        with transaction.atomic(using=self.db):
+            # the address is locked, so it can not be deleted between the two updates
+            if not self.select_for_update().filter(user=user, id=address_id).exists():
+                return False
+            # the previous default is cleared first, as unique constraints may be checked per updated row
+            self._clear_default(field, user, exclude_id=address_id)
+            return bool(self.filter(user=user, id=address_id).update(**{field: True}))
+
+    def find_duplicate(self, address):
+        """
+        return an existing address of the same user, with the same fingerprint (see address_fingerprint())
+        :param address: UserAddress object, saved or not
+        :return: UserAddress object, or None if there is no duplicate
+        """
+        return self.filter(user=address.user_id, fingerprint=address.get_fingerprint()).exclude(
+            id=address.pk).order_by('id').first()
+
+    def get_or_create_address(self, address, update_fields=()):
+        """
+        save a new address, unless the user already has the same address (upsert), then the existing address is
+        returned instead, and becomes default (or default billing) address if the new address was set as one
+        :param address: unsaved UserAddress object
+        :param update_fields: names of fields copied from 'address' to the existing address, eg 'notes'
+        :return: tuple of (UserAddress object, created)
+        """
+        with transaction.atomic(using=self.db):
+            duplicate = self.find_duplicate(address)
+            if duplicate is None:
+                address.save()
+                return address, True
+            update_fields = [name for name in update_fields if name not in ADDRESS_FINGERPRINT_FIELDS]
+            if update_fields:
+                for name in update_fields:
+                    setattr(duplicate, name, getattr(address, name))
+                duplicate.save(update_fields=update_fields)
+            if address.default_address and not duplicate.default_address:
+                self.set_default_address(address.user_id, duplicate.id)
+                duplicate.default_address = True
+            if address.default_billing_address and not duplicate.default_billing_address:
+                self.set_default_billing_address(address.user_id, duplicate.id)
+                duplicate.default_billing_address = True
+            return duplicate, False
+
+    def set_default_address(self, user, address_id):
+        """
+        make an address the default address of its user, the previous default is unset in the same transaction.
+        at most single default address per user is enforced by the database ('unique_default_address'),
+        a concurrent swap of the same user fails with IntegrityError instead of leaving two defaults
+        :param user: User object or email
+        :param address_id: id of one of the users addresses
+        :return: True if address was set as default, False if user has no such address (nothing is changed)
+        """
+        return self._set_default('default_address', user, address_id)
+
+    def set_default_billing_address(self, user, address_id):
+        """
+        make an address the default billing address of its user, see set_default_address()
+        :param user: User object or email
+        :param address_id: id of one of the users addresses
+        :return: True if address was set as default billing address, False if user has no such address
+        """
+        return self._set_default('default_billing_address', user, address_id)
+
 
 class UserAddress(AbstractAddress):
     """
@@ -246,10 +754,25 @@ class UserAddress(AbstractAddress):
 
     class Meta:
         db_table = 'user_addresses'
+        indexes = [
+            models.Index(fields=['user', 'fingerprint'], name='user_address_fingerprint'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(default_address=True),
+                                    name='unique_default_address'),
+            models.UniqueConstraint(fields=['user'], condition=models.Q(default_billing_address=True),
+                                    name='unique_default_billing_address'),
+        ]
         verbose_name = _("User address")
         verbose_name_plural = _("User addresses")
 
+    def validate_constraints(self, exclude=None):
+        # save() swaps 'default_address' and 'default_billing_address' between rows
+        _validate_constraints_except(self, {'unique_default_address', 'unique_default_billing_address'},
+                                     exclude=exclude)
+
     def clean(self):
+        super(UserAddress, self).clean()
         if hasattr(settings, 'ENFORCE_USER_ADDRESS_VERIFIED_PHONE'):
             if settings.ENFORCE_USER_ADDRESS_VERIFIED_PHONE:
                 # try getting self.user, since UserAddress can get created from admin without user reference
@@ -263,24 +786,42 @@ class UserAddress(AbstractAddress):
                     raise ValidationError(message='{} has not been verified.'.format(self.phone_number))
 
     def save(self, *args, **kwargs):
-        # allow exactly single 'default_address=True' value per 'user'
-        if self.default_address:
-            UserAddress.objects.filter(user=self.user, default_address=True).update(default_address=False)
+        """
+        save the address, allowing exactly single 'default_address=True' and single 'default_billing_address=True'
+        per 'user', the previous defaults are unset (see UserAddressManager.set_default_address),
+        in the same transaction as the save
+        """
+        with transaction.atomic():
+            if self.default_address:
+                UserAddress.objects._clear_default('default_address', self.user_id, exclude_id=self.pk)
+            if self.default_billing_address:
+                UserAddress.objects._clear_default('default_billing_address', self.user_id, exclude_id=self.pk)
+            super(UserAddress, self).save(*args, **kwargs)
 
-            # if current user still does not have any default address (first time an address is saved).
-            if not UserAddress.objects.filter(user=self.user, default_address=True):
-                self.default_address = True
 
-        # allow exactly single 'default_billing_address=True' value per 'user'
-        if self.default_billing_address:
-            UserAddress.objects.filter(
-                user=self.user, default_billing_address=True
-            ).update(default_billing_address=False)
+class UserQuerySet(models.QuerySet):
 
-        super(UserAddress, self).save(*args, **kwargs)
+    def with_contact_info(self):
+        """
+        prefetch users phone numbers and addresses (with their phone number),
+        so get_all_phone_numbers(), get_verified_phone_numbers(), get_verified_phone_numbers_list()
+        and get_user_addresses() of each user do not query the database
+        :return: QuerySet of User objects
+        """
+        return self.prefetch_related(
+            models.Prefetch('phone_number_obj', queryset=UserPhoneNumber.objects.order_by('id')),
+            models.Prefetch('addresses', queryset=UserAddress.objects.select_related('phone_number').order_by('id')),
+        )
+
+    def activate(self):
+        """
+        activate inactive users, with a single UPDATE
+        :return: number of users activated
+        """
+        return self.filter(is_active=False).update(is_active=True, last_update_date=utc_now())
 
 
-class UserManager(BaseUserManager):
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     def _create_user(self, email, password, **extra_fields):
         """
         Creates and saves a User with the given email and password.
@@ -308,6 +849,19 @@ class UserManager(BaseUserManager):
             raise ValueError('Superuser must have is_superuser=True.')
         return self._create_user(email, password, **extra_fields)
 
+    def send_verification_emails(self, subject, body, from_mail, users, chunk_size=None):
+        """
+        send verification emails to many users at once,
+        see DjangoEmailVerifierManger.send_verification_emails
+        :param users: QuerySet of User objects, or an iterable of emails
+        :return: dict of email -> True if sent, False if sending failed
+        """
+        return DjangoEmailVerifier.objects.send_verification_emails(subject,
+                                                                    body,
+                                                                    from_mail,
+                                                                    users,
+                                                                    chunk_size=chunk_size)
+
 
 class User(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(unique=True, primary_key=True, validators=[validate_email])
@@ -369,46 +923,237 @@ class User(AbstractBaseUser, PermissionsMixin):
     def get_last_name(self):
         return self.last_name
 
+    def _get_prefetched(self, related_name):
+        """
+        return related objects loaded by prefetch_related (see UserQuerySet.with_contact_info)
+        :return: list, or None if not prefetched
+        """
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        return list(prefetched[related_name]) if related_name in prefetched else None
+
+    # the following return a list (filtered in memory) instead of a QuerySet, if the related objects were prefetched
     def get_user_addresses(self):
+        addresses = self._get_prefetched('addresses')
+        if addresses is not None:
+            return addresses
         return self.addresses.get_all_user_addresses(user=self)
 
     def get_all_phone_numbers(self):
+        phone_numbers = self._get_prefetched('phone_number_obj')
+        if phone_numbers is not None:
+            return phone_numbers
         return self.phone_number_obj.get_all_phone_numbers_of_user(user=self)
 
     def get_verified_phone_numbers(self):
+        phone_numbers = self._get_prefetched('phone_number_obj')
+        if phone_numbers is not None:
+            return [phone_number for phone_number in phone_numbers if phone_number.verified]
         return self.phone_number_obj.get_verified_phone_numbers_of_user(user=self)
 
     def get_verified_phone_numbers_list(self):
+        phone_numbers = self._get_prefetched('phone_number_obj')
+        if phone_numbers is not None:
+            return [phone_number.number for phone_number in phone_numbers if phone_number.verified]
         return self.phone_number_obj.get_verified_number_list(user=self)
 
-    def create_verification_email(self):
-        self.email_verification_obj.create_verification(email=self.email)
+    def create_verification_email(self, refresh_existing=None):
+        self.email_verification_obj.create_verification(email=self.email, refresh_existing=refresh_existing)
 
-    def send_verification_email(self, subject, body, from_mail):
+    def create_verification_token(self):
+        """
+        create a verification token using the backend set in DJANGO_EMAIL_VERIFIER_BACKEND setting,
+        by default a DjangoEmailVerifier object is created, and its uuid is returned
+        :return: token string
+        """
+        from django_user_email_extension.verification_backends import get_verification_backend
+        return get_verification_backend().create_token(self)
+
+    def send_verification_email(self, subject, body, from_mail, ip=None):
         self.email_verification_obj.send_verification_email(subject,
                                                             body,
                                                             from_mail,
-                                                            self.email)
+                                                            self.email,
+                                                            ip=ip)
+
+    def enqueue_verification_email(self, subject, body, from_mail, ip=None):
+        return self.email_verification_obj.enqueue_verification_email(subject,
+                                                                      body,
+                                                                      from_mail,
+                                                                      self.email,
+                                                                      ip=ip)
 
     def get_uuid_of_email(self):
         return self.email_verification_obj.get_uuid_of_email(self.email)
 
 
-class DjangoEmailVerifierManger(models.Manager):
+def _verification_expire_cutoff(now):
+    """
+    return the creation date, verifications created at or before it are expired
+    :param now: datetime object
+    :return: datetime object, or None if "DJANGO_EMAIL_VERIFIER_EXPIRE_TIME" is not defined
+    """
+    hours_to_expire = getattr(settings, 'DJANGO_EMAIL_VERIFIER_EXPIRE_TIME', None)
+    return now - timedelta(hours=hours_to_expire) if hours_to_expire is not None else None
+
+
+def _pending_condition(now):
+    """
+    :return: Q object of verifications that are not expired, by expire() or by DJANGO_EMAIL_VERIFIER_EXPIRE_TIME
+    """
+    condition = models.Q(expired_at__isnull=True)
+    cutoff = _verification_expire_cutoff(now)
+    if cutoff is not None:
+        condition &= models.Q(date_created__gt=cutoff)
+    return condition
+
+
+class DjangoEmailVerifierQuerySet(models.QuerySet):
+
+    def with_expiry(self):
+        """
+        annotate 'expires_at' ('expired_at' if set by expire(), otherwise
+        date_created + DJANGO_EMAIL_VERIFIER_EXPIRE_TIME), and 'is_expired',
+        both calculated by the database, same as uuid_expire_date() and is_uuid_expired() of each object.
+        if DJANGO_EMAIL_VERIFIER_EXPIRE_TIME is not defined, only verifications expired by expire() are expired
+        :return: QuerySet of DjangoEmailVerifier objects
+        """
+        hours_to_expire = getattr(settings, 'DJANGO_EMAIL_VERIFIER_EXPIRE_TIME', None)
+        if hours_to_expire is None:
+            expires_at = models.F('expired_at')
+        else:
+            expires_at = Coalesce('expired_at',
+                                  models.ExpressionWrapper(models.F('date_created') + timedelta(hours=hours_to_expire),
+                                                           output_field=models.DateTimeField()))
+
+        return self.annotate(
+            expires_at=expires_at
+        ).annotate(
+            is_expired=models.Case(models.When(expires_at__lte=Now(), then=models.Value(True)),
+                                   default=models.Value(False),
+                                   output_field=models.BooleanField())
+        )
+
+    def expired(self):
+        """
+        return verifications that were not verified, and their uuid has expired
+        :return: QuerySet of DjangoEmailVerifier objects
+        """
+        return self.filter(models.Q(is_verified=False) & ~_pending_condition(utc_now()))
+
+    def pending(self):
+        """
+        return verifications that were not verified yet, and their uuid has not expired
+        :return: QuerySet of DjangoEmailVerifier objects
+        """
+        return self.filter(models.Q(is_verified=False) & _pending_condition(utc_now()))
+
+    def verified(self):
+        return self.filter(is_verified=True)
+
+    def expire(self):
+        """
+        expire pending verifications now, with a single UPDATE of 'expired_at' (creation dates are not changed),
+        their uuids are reported as expired on activation
+        :return: number of verifications expired
+        """
+        return self.pending().update(expired_at=utc_now())
+
+    def latest_for_email(self, email):
+        """
+        return the newest verification of an email, ignoring expired verifications (that were never verified)
+        :param email: email string
+        :return: DjangoEmailVerifier object, raises DjangoEmailVerifier.DoesNotExist if not found
+        """
+        queryset = self.filter(models.Q(is_verified=True) | _pending_condition(utc_now()), email=email)
+        return queryset.latest('date_created', 'id')
+
+    def purgeable(self, verified_older_than=None):
+        """
+        return verifications that can be deleted, expired verifications that were never verified,
+        and optionally verified ones that were created more than 'verified_older_than' days ago
+        :param verified_older_than: number of days, or None to keep all verified verifications
+        :return: QuerySet of DjangoEmailVerifier objects
+        """
+        queryset = self.expired()
+        if verified_older_than is not None:
+            queryset |= self.verified().filter(date_created__lte=utc_now() - timedelta(days=verified_older_than))
+        return queryset
+
+
+class ActivationResult(enum.Enum):
+    ACTIVATED = 'activated'
+    EXPIRED = 'expired'
+    ALREADY_VERIFIED = 'already_verified'
+    UNKNOWN = 'unknown'
+
 
-    def create_verification(self, email, user=None):
+class DjangoEmailVerifierManger(models.Manager.from_queryset(DjangoEmailVerifierQuerySet)):
+
+    def create_verification(self, email, user=None, refresh_existing=None):
+        """
+        create a verification for users email.
+        if 'refresh_existing' is set, the newest unverified verification of the email (if any) gets a new uuid
+        and creation date, instead of inserting another row, so there is a single verification per email.
+        :param email: email to verify
+        :param user: User object, not required if called from users related manager
+        :param refresh_existing: boolean, defaults to DJANGO_EMAIL_VERIFIER_REFRESH_EXISTING setting, or False
+        :return: DjangoEmailVerifier object
+        """
         user = user or getattr(self, 'instance', None)
         if not user:
             raise ValueError('User object must be provided')
 
         if email not in user.email:
             raise ValueError('Email does not belong to user: %s', user.get_username())
+
+        if refresh_existing is None:
+            refresh_existing = getattr(settings, 'DJANGO_EMAIL_VERIFIER_REFRESH_EXISTING', False)
+        if refresh_existing:
+            verification = self.filter(user=user, email=email, is_verified=False).order_by('-date_created', '-id').first()
+            if verification:
+                verification.verification_uuid = uuid.uuid4()
+                verification.date_created = utc_now()
+                verification.expired_at = None
+                verification.save(update_fields=['verification_uuid', 'date_created', 'expired_at'])
+                return verification
         return self.create(user=user, email=email)
 
+    def create_verifications_bulk(self, users_or_emails, batch_size=500):
+        """
+        create verifications for many users, uuids are generated here and rows are inserted with bulk_create,
+        so each batch is a single INSERT.
+        emails that do not belong to any user are skipped, and are not included in the returned dict.
+        :param users_or_emails: iterable of User objects, or emails of existing users
+        :param batch_size: number of verifications inserted per batch
+        :return: dict of email -> verification UUID
+        """
+        result = {}
+        for batch in chunked(users_or_emails, batch_size):
+            emails = [item.email if isinstance(item, User) else item for item in batch]
+
+            # User objects own their email, only plain emails should be matched against existing users
+            plain_emails = {item for item in batch if not isinstance(item, User)}
+            if plain_emails:
+                existing = set(User.objects.filter(email__in=plain_emails).values_list('email', flat=True))
+                emails = [email for email in emails if email not in plain_emails or email in existing]
+
+            verifications = [self.model(user_id=email, email=email, verification_uuid=uuid.uuid4())
+                             for email in dict.fromkeys(emails)]
+            self.bulk_create(verifications, batch_size=batch_size)
+            result.update((verification.email, verification.verification_uuid) for verification in verifications)
+        return result
+
     # @receiver(post_save, sender=DjangoEmailVerifier, dispatch_uid="verify new account")
     # def send_verification_email(sender, instance, signal, *args, **kwargs):
-    def send_verification_email(self, subject, body, from_mail, to_mail):
-        email_verification_onj = self.all().get(email=to_mail)
+    def send_verification_email(self, subject, body, from_mail, to_mail, ip=None):
+        """
+        send verification email, if the email was not verified yet.
+        sends are throttled per email and per ip (see throttling.check_resend_throttle),
+        :param ip: ip address of the request, used for throttling
+        :return: True, raises VerificationEmailThrottled if throttled
+        """
+        check_resend_throttle(to_mail, ip)
+        email_verification_onj = self.latest_for_email(to_mail)
 
         if not email_verification_onj.is_verified:
             send_mail(
@@ -421,8 +1166,182 @@ class DjangoEmailVerifierManger(models.Manager):
 
         return True
 
+    def enqueue_verification_email(self, subject, body, from_mail, to_mail, ip=None):
+        """
+        same as send_verification_email, but the email is stored in the EmailOutbox,
+        and sent later by the 'run_email_outbox' management command.
+        :return: EmailOutbox object, or None if email already verified, raises VerificationEmailThrottled if throttled
+        """
+        check_resend_throttle(to_mail, ip)
+        email_verification_onj = self.latest_for_email(to_mail)
+
+        if not email_verification_onj.is_verified:
+            return EmailOutbox.objects.enqueue(subject, body, from_mail, email_verification_onj.email)
+        return None
+
+    def send_verification_emails(self, subject, body, from_mail, recipients, chunk_size=None):
+        """
+        send verification emails to many recipients, unverified verifications are fetched in chunks,
+        and each chunk is sent over a single mail connection.
+
+        'subject' and 'body' can be strings, or callables that get a DjangoEmailVerifier object and return a string,
+        so each message can contain its own verification uuid.
+        expired verifications are not sent, if an email has more than one pending verification, only the newest is sent.
+        :param subject: string or callable
+        :param body: string or callable
+        :param from_mail: sender email
+        :param recipients: QuerySet (of DjangoEmailVerifier or User objects), or an iterable of emails
+        :param chunk_size: number of recipients per chunk (and per connection),
+                           defaults to DJANGO_EMAIL_VERIFIER_BULK_CHUNK_SIZE setting, or 500
+        :return: dict of email -> True if sent, False if sending failed,
+                 emails without pending verification are not included
+        """
+        chunk_size = chunk_size or getattr(settings, 'DJANGO_EMAIL_VERIFIER_BULK_CHUNK_SIZE', 500)
+        if isinstance(recipients, models.QuerySet):
+            recipients = recipients.values_list('email', flat=True).iterator(chunk_size=chunk_size)
+
+        result = {}
+        for emails in chunked(recipients, chunk_size):
+            verifications = {}
+            # ordered by creation, so newer verifications of the same email override older ones
+            for verification in self.pending().filter(email__in=emails).order_by('date_created', 'id'):
+                verifications[verification.email] = verification
+            sent = self._send_verification_chunk(subject, body, from_mail, verifications.values())
+            result.update((email, sent[verification.id]) for email, verification in verifications.items())
+        return result
+
+    def send_selected_verification_emails(self, subject, body, from_mail, verifications, chunk_size=None):
+        """
+        send a verification email for each of the given verifications, with its own uuid
+        (send_verification_emails() sends the newest pending verification of each email instead),
+        each chunk is sent over a single mail connection. verified and expired verifications are not sent.
+        :param subject: string or callable, see send_verification_emails()
+        :param body: string or callable, see send_verification_emails()
+        :param from_mail: sender email
+        :param verifications: QuerySet of DjangoEmailVerifier objects
+        :param chunk_size: number of verifications per chunk (and per connection),
+                           defaults to DJANGO_EMAIL_VERIFIER_BULK_CHUNK_SIZE setting, or 500
+        :return: dict of DjangoEmailVerifier id -> True if sent, False if sending failed,
+                 verifications that are not pending are not included
+        """
+        chunk_size = chunk_size or getattr(settings, 'DJANGO_EMAIL_VERIFIER_BULK_CHUNK_SIZE', 500)
+        result = {}
+        for chunk in chunked(verifications.pending().order_by('id').iterator(chunk_size=chunk_size), chunk_size):
+            result.update(self._send_verification_chunk(subject, body, from_mail, chunk))
+        return result
+
+    @staticmethod
+    def _send_verification_chunk(subject, body, from_mail, verifications):
+        """
+        send a message per verification, all over the same mail connection
+        :return: dict of DjangoEmailVerifier id -> True if sent, False if sending failed
+        """
+        result = {}
+        try:
+            connection = get_connection()
+            connection.open()
+        except Exception:
+            return {verification.id: False for verification in verifications}
+
+        try:
+            for verification in verifications:
+                # any error fails its recipient only, eg BadHeaderError (a ValueError) of a subject with a newline
+                try:
+                    message = EmailMessage(subject(verification) if callable(subject) else subject,
+                                           body(verification) if callable(body) else body,
+                                           from_mail,
+                                           [verification.email],  # To
+                                           connection=connection)
+                    result[verification.id] = bool(connection.send_messages([message]))
+                except Exception:
+                    result[verification.id] = False
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        return result
+
     def get_uuid_of_email(self, email):
-        return self.all().get(email=email).verification_uuid
+        return self.latest_for_email(email).verification_uuid
+
+    def get_by_uuid(self, verification_uuid):
+        """
+        return the verification object of a uuid, together with its user (in a single query)
+        :param verification_uuid: UUID object or string
+        :return: DjangoEmailVerifier object, raises DjangoEmailVerifier.DoesNotExist if not found
+        """
+        return self.select_related('user').get(verification_uuid=verification_uuid)
+
+    def activate_by_uuid(self, verification_uuid):
+        """
+        verify an email and activate its user.
+        the verification is updated with a single conditional UPDATE (not verified, and not expired),
+        so concurrent activations of the same uuid can not both succeed.
+        :param verification_uuid: UUID object or string
+        :return: ActivationResult
+        """
+        try:
+            verification_uuid = uuid.UUID(str(verification_uuid))
+        except ValueError:
+            return ActivationResult.UNKNOWN
+
+        now = utc_now()
+        with transaction.atomic():
+            activatable = self.pending().filter(verification_uuid=verification_uuid)
+            if activatable.update(is_verified=True, verified_at=now):
+                User.objects.filter(
+                    email_verification_obj__verification_uuid=verification_uuid
+                ).update(is_active=True, last_update_date=now)
+                return ActivationResult.ACTIVATED
+
+        # nothing was updated, find out why
+        is_verified = self.filter(verification_uuid=verification_uuid).values_list('is_verified', flat=True).first()
+        if is_verified is None:
+            return ActivationResult.UNKNOWN
+        return ActivationResult.ALREADY_VERIFIED if is_verified else ActivationResult.EXPIRED
+
+    def activate_many(self, verification_uuids, batch_size=500):
+        """
+        verify emails and activate their users, each batch runs in a single transaction
+        :param verification_uuids: iterable of UUID objects or strings
+        :param batch_size: number of uuids handled per transaction
+        :return: dict of uuid (as received) -> ActivationResult
+        """
+        result = {}
+        for batch in chunked(verification_uuids, batch_size):
+            parsed = {}
+            for verification_uuid in batch:
+                try:
+                    parsed[uuid.UUID(str(verification_uuid))] = verification_uuid
+                except ValueError:
+                    result[verification_uuid] = ActivationResult.UNKNOWN
+
+            now = utc_now()
+            cutoff = _verification_expire_cutoff(now)
+            with transaction.atomic():
+                activatable_ids, user_ids = [], []
+                rows = self.select_for_update().filter(verification_uuid__in=parsed.keys()).values_list(
+                    'id', 'verification_uuid', 'is_verified', 'date_created', 'expired_at', 'user_id')
+                for verification_id, verification_uuid, is_verified, date_created, expired_at, user_id in rows:
+                    if is_verified:
+                        status = ActivationResult.ALREADY_VERIFIED
+                    elif expired_at is not None or (cutoff is not None and date_created <= cutoff):
+                        status = ActivationResult.EXPIRED
+                    else:
+                        status = ActivationResult.ACTIVATED
+                        activatable_ids.append(verification_id)
+                        user_ids.append(user_id)
+                    result[parsed.pop(verification_uuid)] = status
+
+                if activatable_ids:
+                    self.filter(id__in=activatable_ids, is_verified=False).update(is_verified=True, verified_at=now)
+                    User.objects.filter(email__in=user_ids).update(is_active=True, last_update_date=now)
+
+            # uuids left were not found
+            for verification_uuid in parsed.values():
+                result[verification_uuid] = ActivationResult.UNKNOWN
+        return result
 
 
 class DjangoEmailVerifier(models.Model):
@@ -433,9 +1352,11 @@ class DjangoEmailVerifier(models.Model):
     # user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     email = models.EmailField(max_length=255)
     is_verified = models.BooleanField('verified', default=False)
-    verification_uuid = models.UUIDField('Unique Verification UUID', default=uuid.uuid4)
+    verification_uuid = models.UUIDField('Unique Verification UUID', default=uuid.uuid4, unique=True)
     date_created = models.DateTimeField('Date Created', auto_now_add=True, blank=True)
     verified_at = models.DateTimeField(blank=True, null=True)
+    # set when expired before DJANGO_EMAIL_VERIFIER_EXPIRE_TIME passed, see DjangoEmailVerifierQuerySet.expire()
+    expired_at = models.DateTimeField(blank=True, null=True)
 
     objects = DjangoEmailVerifierManger()
 
@@ -445,6 +1366,10 @@ class DjangoEmailVerifier(models.Model):
         verbose_name = _('email verifications')
         verbose_name_plural = _('email verifications')
         db_table = 'email_verifications'
+        indexes = [
+            models.Index(fields=['is_verified', 'date_created'], name='email_verif_verified_created'),
+            models.Index(fields=['email', 'date_created'], name='email_verif_email_created'),
+        ]
 
     def __str__(self):
         return 'Email Verification for User: ' + str(self.email)
@@ -457,8 +1382,11 @@ class DjangoEmailVerifier(models.Model):
         The method checks for an expiration time (DJANGO_EMAIL_VERIFIER_EXPIRE_TIME) in the Django settings.
         If it's set, it adds that time (in hours) to the date_created of an object, returning the expiration date.
         If not, it returns None, meaning no expiration is defined.
+        A verification expired by DjangoEmailVerifierQuerySet.expire() returns its 'expired_at' date.
         :return: datetime object, or None if "DJANGO_EMAIL_VERIFIER_EXPIRE_TIME" is not defined
         """
+        if self.expired_at is not None:
+            return self.expired_at
         hours_to_expire = getattr(settings, 'DJANGO_EMAIL_VERIFIER_EXPIRE_TIME', None)
         return self.date_created + timedelta(hours=hours_to_expire) if hours_to_expire is not None else None
 
@@ -480,12 +1408,167 @@ class DjangoEmailVerifier(models.Model):
         if not self.verified():
             self.is_verified = True
             self.verified_at = datetime.now(tz=timezone.utc)
-            self.save()
+            self.save(update_fields=['is_verified', 'verified_at'])
         else:
             raise Exception("email {} already verified".format(self.email))
 
         # Set account is active status
         self.user.is_active = True
-        self.user.save()
+        self.user.save(update_fields=['is_active', 'last_update_date'])
 
         return True
+
+
+class EmailOutboxManager(models.Manager):
+
+    def enqueue(self, subject, body, from_mail, to_mail):
+        """
+        store an email, to be sent later by the 'run_email_outbox' management command
+        :return: EmailOutbox object
+        """
+        return self.create(subject=subject, body=body, from_email=from_mail, to_email=to_mail)
+
+    def claim(self, limit, lease_seconds=300, max_attempts=None):
+        """
+        claim pending emails for sending, claimed emails are marked as 'sending' for 'lease_seconds',
+        if not reported sent or failed by then (worker died), they can be claimed again.
+        each claim counts as an attempt, so an email whose lease keeps expiring (it kills its worker, or takes longer
+        than the lease to send) is marked as failed once 'max_attempts' claims expired, instead of claimed forever.
+        rows are selected with SELECT ... FOR UPDATE SKIP LOCKED where supported, on other databases (SQLite)
+        the claim relies on a conditional UPDATE, so the same email can not be claimed by two workers.
+        :param limit: maximum number of emails to claim
+        :param lease_seconds: seconds the emails are reserved for the current worker
+        :param max_attempts: number of attempts after which emails with an expired lease are failed, None for no limit
+        :return: list of EmailOutbox objects
+        """
+        now = utc_now()
+        lease_until = now + timedelta(seconds=lease_seconds)
+        claimable = self.filter(status__in=[EmailOutbox.STATUS_PENDING, EmailOutbox.STATUS_SENDING],
+                                next_attempt_at__lte=now)
+        with transaction.atomic(using=self.db):
+            if max_attempts is not None:
+                claimable.filter(status=EmailOutbox.STATUS_SENDING, attempts__gte=max_attempts).update(
+                    status=EmailOutbox.STATUS_FAILED, last_error='Lease expired, email was not reported as sent')
+            candidates = claimable.order_by('next_attempt_at')
+            if connections[self.db].features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            ids = list(candidates.values_list('id', flat=True)[:limit])
+            claimable.filter(id__in=ids).update(status=EmailOutbox.STATUS_SENDING,
+                                                next_attempt_at=lease_until,
+                                                attempts=models.F('attempts') + 1)
+        return list(self.filter(id__in=ids, status=EmailOutbox.STATUS_SENDING, next_attempt_at=lease_until))
+
+    def send_pending(self, batch_size=100, workers=4, max_attempts=5, backoff_seconds=60):
+        """
+        claim a batch of pending emails, and send them with a pool of 'workers' threads,
+        each thread uses a single mail connection.
+        failed emails are retried with exponential backoff (backoff_seconds * 2 ^ (attempts - 1)),
+        until 'max_attempts' is reached, then marked as failed.
+        :return: dict with the number of 'sent', 'retry' and 'failed' emails
+        """
+        result = {'sent': 0, 'retry': 0, 'failed': 0}
+        # attempts are counted by claim()
+        messages = self.claim(batch_size, max_attempts=max_attempts)
+        if not messages:
+            return result
+
+        slices = [messages[i::workers] for i in range(min(workers, len(messages)))]
+        with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+            futures = [(executor.submit(self._send_slice, messages_slice), messages_slice) for messages_slice in slices]
+            errors = {}
+            for future, messages_slice in futures:
+                # a failing slice must not prevent marking emails of other slices as sent
+                try:
+                    errors.update(future.result())
+                except Exception as e:
+                    errors.update({message.id: str(e) for message in messages_slice})
+
+        now = utc_now()
+        sent_ids = [message.id for message in messages if message.id not in errors]
+        if sent_ids:
+            self.filter(id__in=sent_ids).update(status=EmailOutbox.STATUS_SENT,
+                                                sent_at=now,
+                                                last_error='')
+            result['sent'] = len(sent_ids)
+
+        failed_messages = [message for message in messages if message.id in errors]
+        for message in failed_messages:
+            message.last_error = errors[message.id]
+            if message.attempts >= max_attempts:
+                message.status = EmailOutbox.STATUS_FAILED
+                result['failed'] += 1
+            else:
+                message.status = EmailOutbox.STATUS_PENDING
+                message.next_attempt_at = now + timedelta(seconds=backoff_seconds * 2 ** (message.attempts - 1))
+                result['retry'] += 1
+        self.bulk_update(failed_messages, ['status', 'next_attempt_at', 'last_error'])
+        return result
+
+    @staticmethod
+    def _send_slice(messages):
+        """
+        send emails over a single mail connection, this runs in a worker thread, so no database access here
+        :return: dict of EmailOutbox id -> error string, for emails that failed
+        """
+        try:
+            connection = get_connection()
+            connection.open()
+        except Exception as e:
+            return {message.id: str(e) for message in messages}
+
+        errors = {}
+        try:
+            for message in messages:
+                # any error is recorded for its email only, eg BadHeaderError (a ValueError) of a subject with a newline
+                try:
+                    connection.send_messages([EmailMessage(message.subject,
+                                                           message.body,
+                                                           message.from_email,
+                                                           [message.to_email],
+                                                           connection=connection)])
+                except Exception as e:
+                    errors[message.id] = str(e)
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        return errors
+
+
+class EmailOutbox(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    id = models.AutoField(primary_key=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to_email = models.EmailField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=utc_now)
+    created_at = models.DateTimeField(_('Date Created'), auto_now_add=True, blank=True, editable=False)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    objects = EmailOutboxManager()
+
+    class Meta:
+        verbose_name = _('email outbox')
+        verbose_name_plural = _('email outbox')
+        db_table = 'email_outbox'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_outbox_status_next'),
+        ]
+
+    def __str__(self):
+        return 'Email to: {} ({})'.format(self.to_email, self.status)
@@ -0,0 +1,110 @@
+import re
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from phonenumbers import NumberParseException, PhoneMetadata, PhoneNumberFormat, carrier, format_number, geocoder, \
+    is_valid_number, parse
+
+from django_user_email_extension.utils import chunked
+
+# numbers are looked up in large metadata tables, results are cached per process
+LOOKUP_CACHE_SIZE = 10000
+
+INVALID_NUMBER_ERROR = 'Invalid phone number'
+
+# result of a number validation, 'error' is None if number is valid, otherwise 'e164' and 'country_code' are None
+ValidatedNumber = namedtuple('ValidatedNumber', ['e164', 'country_code', 'error'])
+
+# characters commonly used to format numbers, removed before validation (and caching)
+_SEPARATORS_REGEX = re.compile(r'[\s\-.()/]')
+
+
+@lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def get_number_carrier(number):
+    """
+    get numbers mobile carrier, return empty string is not found.
+    :param number: number string in E.164 format
+    :return: string
+    """
+    return carrier.name_for_number(parse(number), "en")
+
+
+@lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def get_number_location(number):
+    """
+    return a text description of numbers location, return empty string is not found.
+    :param number: number string in E.164 format
+    :return: string
+    """
+    return geocoder.description_for_number(parse(number), "en")
+
+
+def get_number_metadata(number):
+    """
+    return carrier and location of a number, empty strings if number can not be parsed
+    :param number: number string in E.164 format
+    :return: tuple of (carrier, location)
+    """
+    try:
+        return get_number_carrier(number), get_number_location(number)
+    except NumberParseException:
+        return '', ''
+
+
+def warm_metadata():
+    """
+    load metadata of all regions, instead of lazily on first number of each region.
+    used as process pool initializer, so each worker loads metadata once
+    """
+    PhoneMetadata.load_all()
+
+
+@lru_cache(maxsize=LOOKUP_CACHE_SIZE)
+def _validate_normalised_number(number, region):
+    try:
+        phone_number = parse(number, region)
+    except NumberParseException as e:
+        return ValidatedNumber(None, None, str(e))
+    if not is_valid_number(phone_number):
+        return ValidatedNumber(None, None, INVALID_NUMBER_ERROR)
+    return ValidatedNumber(format_number(phone_number, PhoneNumberFormat.E164), phone_number.country_code, None)
+
+
+def validate_number(number, region=None):
+    """
+    validate a phone number, results are cached per process (keyed on number without separators)
+    :param number: raw number string, eg '+1 (212) 509-5555'
+    :param region: region code (eg 'US') for numbers without country code, or None
+    :return: ValidatedNumber
+    """
+    return _validate_normalised_number(_SEPARATORS_REGEX.sub('', str(number)), region)
+
+
+def _validate_chunk(numbers, region):
+    return [validate_number(number, region) for number in numbers]
+
+
+def validate_many(numbers, region=None, workers=None, chunk_size=1000):
+    """
+    validate phone numbers, results are yielded in input order as they are ready, so input is not loaded into memory.
+    if workers is set, numbers are validated in chunks by a pool of processes, with a bounded number of chunks in flight
+    :param numbers: iterable of raw number strings
+    :param region: region code (eg 'US') for numbers without country code, or None
+    :param workers: number of processes, None or 1 to validate in current process
+    :param chunk_size: number of numbers sent to a process at once
+    :return: generator of ValidatedNumber
+    """
+    if not workers or workers < 2:
+        for number in numbers:
+            yield validate_number(number, region)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_metadata) as executor:
+        pending = deque()
+        for chunk in chunked(numbers, chunk_size):
+            pending.append(executor.submit(_validate_chunk, chunk, region))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
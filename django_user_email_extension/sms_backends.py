@@ -0,0 +1,64 @@
+import sys
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# used when PHONE_VERIFICATION_SMS_BACKEND is not set, only if DEBUG is on
+DEBUG_SMS_BACKEND = 'django_user_email_extension.sms_backends.ConsoleSMSBackend'
+
+# messages sent by LocmemSMSBackend, as (number, text) tuples
+outbox = []
+
+
+def get_sms_backend():
+    """
+    return an instance of the backend set in PHONE_VERIFICATION_SMS_BACKEND setting,
+    if not set, ConsoleSMSBackend is used when DEBUG is on, otherwise ImproperlyConfigured is raised
+    (so codes are never written to stdout of a production server by mistake)
+    """
+    backend = getattr(settings, 'PHONE_VERIFICATION_SMS_BACKEND', None)
+    if backend is None:
+        if not settings.DEBUG:
+            raise ImproperlyConfigured('PHONE_VERIFICATION_SMS_BACKEND setting must be set when DEBUG is off')
+        backend = DEBUG_SMS_BACKEND
+    return import_string(backend)()
+
+
+class BaseSMSBackend:
+
+    def send_messages(self, messages):
+        """
+        send text messages, backends should send the whole list over a single connection (or API request) if possible
+        :param messages: list of (number, text) tuples, number is a string in E.164 format
+        :return: number of messages sent
+        """
+        raise NotImplementedError('subclasses of BaseSMSBackend must provide a send_messages() method')
+
+
+class ConsoleSMSBackend(BaseSMSBackend):
+    """
+    write messages to stdout, for development (do not use in production, codes are written to logs)
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.RLock()
+
+    def send_messages(self, messages):
+        with self._lock:
+            for number, text in messages:
+                self.stream.write('SMS to: {}\n{}\n{}\n'.format(number, text, '-' * 79))
+            self.stream.flush()
+        return len(messages)
+
+
+class LocmemSMSBackend(BaseSMSBackend):
+    """
+    store messages in 'django_user_email_extension.sms_backends.outbox', for tests
+    """
+
+    def send_messages(self, messages):
+        outbox.extend(messages)
+        return len(messages)
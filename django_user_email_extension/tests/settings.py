@@ -56,6 +56,8 @@ TEMPLATES = [
     },
 ]
 
+ROOT_URLCONF = 'django_user_email_extension.tests.urls'
+
 WSGI_APPLICATION = 'django_user_email_extension.wsgi.application'
 
 # Database
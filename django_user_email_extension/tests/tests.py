@@ -1,9 +1,34 @@
+import json
+import os
+import smtplib
+import tempfile
 from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.db.utils import IntegrityError
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-from django_user_email_extension.models import User, DjangoEmailVerifier, UserAddress, UserPhoneNumber
+from django_user_email_extension.forms import PhoneNumberVerificationForm, UserAddressForm
+from django_user_email_extension import sms_backends
+from django_user_email_extension.models import ActivationResult, User, DjangoEmailVerifier, EmailOutbox, UserAddress, \
+    UserPhoneNumber, PhoneVerificationCode, PhoneVerificationResult, utc_now
+from django_user_email_extension.phone_numbers import INVALID_NUMBER_ERROR, validate_many, validate_number
+from django_user_email_extension.throttling import VerificationEmailThrottled
+from django_user_email_extension.timezones import get_country_timezones
+from django_user_email_extension.validators import postal_code_validator
+from django_user_email_extension.verification_backends import get_verification_backend
+
+LOCMEM_SMS_BACKEND = 'django_user_email_extension.sms_backends.LocmemSMSBackend'
+SIGNED_BACKEND = 'django_user_email_extension.verification_backends.SignedTokenVerificationBackend'
 
 
 class TestUserModel(TestCase):
@@ -148,6 +173,77 @@ class TestDjangoEmailVerifierModel(TestCase):
         self.assertTrue(self.email_object.activate_user(), msg="function activate_user should return true")
         self.assertTrue(self.user.is_active, msg="User should be active at this point")
 
+    def test_with_expiry(self):
+        email_object = DjangoEmailVerifier.objects.with_expiry().get(id=self.email_object.id)
+        self.assertEqual(email_object.expires_at, self.email_object.uuid_expire_date())
+        self.assertFalse(email_object.is_expired)
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_EXPIRE_TIME=0)
+    def test_with_expiry_expired(self):
+        # database clock may have lower precision than date_created
+        DjangoEmailVerifier.objects.filter(id=self.email_object.id).update(
+            date_created=utc_now() - timedelta(seconds=1))
+        self.assertTrue(DjangoEmailVerifier.objects.with_expiry().get(id=self.email_object.id).is_expired)
+        self.assertEqual(DjangoEmailVerifier.objects.with_expiry().filter(is_expired=True).count(), 1)
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_EXPIRE_TIME=None)
+    def test_with_expiry_none(self):
+        email_object = DjangoEmailVerifier.objects.with_expiry().get(id=self.email_object.id)
+        self.assertIsNone(email_object.expires_at)
+        self.assertFalse(email_object.is_expired)
+        self.assertEqual(DjangoEmailVerifier.objects.expired().count(), 0)
+        self.assertEqual(DjangoEmailVerifier.objects.pending().count(), 1)
+
+    def test_status_querysets(self):
+        self.assertEqual(list(DjangoEmailVerifier.objects.pending()), [self.email_object])
+        self.assertEqual(DjangoEmailVerifier.objects.expired().count(), 0)
+        self.assertEqual(DjangoEmailVerifier.objects.verified().count(), 0)
+
+        with override_settings(DJANGO_EMAIL_VERIFIER_EXPIRE_TIME=0):
+            self.assertEqual(list(DjangoEmailVerifier.objects.expired()), [self.email_object])
+            self.assertEqual(DjangoEmailVerifier.objects.pending().count(), 0)
+
+        DjangoEmailVerifier.objects.update(is_verified=True)
+        self.assertEqual(list(self.user.email_verification_obj.verified()), [self.email_object])
+
+    def test_activate_by_uuid(self):
+        uuid_num = self.email_object.verification_uuid
+        self.assertEqual(DjangoEmailVerifier.objects.activate_by_uuid(uuid_num), ActivationResult.ACTIVATED)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active, msg="User should be active at this point")
+
+        # second click on the same link
+        self.assertEqual(DjangoEmailVerifier.objects.activate_by_uuid(str(uuid_num)),
+                         ActivationResult.ALREADY_VERIFIED)
+        self.assertEqual(DjangoEmailVerifier.objects.activate_by_uuid('00000000-0000-0000-0000-000000000000'),
+                         ActivationResult.UNKNOWN)
+        self.assertEqual(DjangoEmailVerifier.objects.activate_by_uuid('not-a-uuid'), ActivationResult.UNKNOWN)
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_EXPIRE_TIME=0)
+    def test_activate_by_uuid_expired(self):
+        self.assertEqual(DjangoEmailVerifier.objects.activate_by_uuid(self.email_object.verification_uuid),
+                         ActivationResult.EXPIRED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active, msg="User should not be active at this point")
+
+    def test_activate_many(self):
+        user_bob = User.objects.create(email="test_bob@nalkins.cloud")
+        bob_email_object = DjangoEmailVerifier.objects.create(user=user_bob, email=user_bob.email, is_verified=True)
+        unknown_uuid = '00000000-0000-0000-0000-000000000000'
+
+        result = DjangoEmailVerifier.objects.activate_many([self.email_object.verification_uuid,
+                                                            bob_email_object.verification_uuid,
+                                                            unknown_uuid,
+                                                            'not-a-uuid'], batch_size=2)
+        self.assertEqual(result, {
+            self.email_object.verification_uuid: ActivationResult.ACTIVATED,
+            bob_email_object.verification_uuid: ActivationResult.ALREADY_VERIFIED,
+            unknown_uuid: ActivationResult.UNKNOWN,
+            'not-a-uuid': ActivationResult.UNKNOWN,
+        })
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active, msg="User should be active at this point")
+
 
 class TestUserManager(TestCase):
 
@@ -182,6 +278,314 @@ class TestDjangoEmailVerifierManger(TestCase):
         uuid_num = DjangoEmailVerifier.objects.get_uuid_of_email(self.email_object.email)
         self.assertRegex(str(uuid_num), '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
 
+    def test_get_uuid_of_email_multiple_verifications(self):
+        newest = DjangoEmailVerifier.objects.create_verification(email=self.user.email, user=self.user)
+        self.assertEqual(DjangoEmailVerifier.objects.get_uuid_of_email(self.user.email), newest.verification_uuid)
+        self.assertEqual(DjangoEmailVerifier.objects.count(), 2)
+
+        self.user.send_verification_email(subject='s', body='b', from_mail='noreply@nalkins.cloud')
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_EXPIRE_TIME=0)
+    def test_latest_for_email_expired(self):
+        with self.assertRaises(DjangoEmailVerifier.DoesNotExist):
+            DjangoEmailVerifier.objects.latest_for_email(self.user.email)
+
+    def test_create_verification_refresh_existing(self):
+        existing = DjangoEmailVerifier.objects.get(email=self.user.email)
+        refreshed = DjangoEmailVerifier.objects.create_verification(email=self.user.email,
+                                                                    user=self.user,
+                                                                    refresh_existing=True)
+        self.assertEqual(refreshed.id, existing.id)
+        self.assertNotEqual(refreshed.verification_uuid, existing.verification_uuid)
+        self.assertGreater(refreshed.date_created, existing.date_created)
+        self.assertEqual(DjangoEmailVerifier.objects.count(), 1)
+
+        with override_settings(DJANGO_EMAIL_VERIFIER_REFRESH_EXISTING=True):
+            self.user.create_verification_email()
+        self.assertEqual(DjangoEmailVerifier.objects.count(), 1)
+
+    def test_create_verifications_bulk(self):
+        user_bob = User.objects.create(email="test_verification_manager_bob@nalkins.cloud")
+        user_eve = User.objects.create(email="test_verification_manager_eve@nalkins.cloud")
+
+        with self.assertNumQueries(2):
+            result = DjangoEmailVerifier.objects.create_verifications_bulk(
+                [user_bob, user_eve.email, 'unknown@nalkins.cloud', user_bob], batch_size=10)
+
+        self.assertEqual(set(result.keys()), {user_bob.email, user_eve.email})
+        self.assertEqual(user_eve.get_uuid_of_email(), result[user_eve.email])
+        self.assertEqual(DjangoEmailVerifier.objects.filter(user=user_bob).count(), 1)
+
+    def test_get_by_uuid(self):
+        uuid_num = DjangoEmailVerifier.objects.get_uuid_of_email(self.user.email)
+        with self.assertNumQueries(1):
+            email_object = DjangoEmailVerifier.objects.get_by_uuid(uuid_num)
+            self.assertEqual(email_object.user.email, self.user.email)
+
+        with self.assertRaises(DjangoEmailVerifier.DoesNotExist):
+            DjangoEmailVerifier.objects.get_by_uuid('00000000-0000-0000-0000-000000000000')
+
+    def test_unique_verification_uuid(self):
+        uuid_num = DjangoEmailVerifier.objects.get_uuid_of_email(self.user.email)
+        with self.assertRaises(IntegrityError):
+            DjangoEmailVerifier.objects.create(user=self.user, email=self.user.email, verification_uuid=uuid_num)
+
+    def test_send_verification_emails(self):
+        user_bob = User.objects.create(email="test_verification_manager_bob@nalkins.cloud")
+        DjangoEmailVerifier.objects.create_verification(email=user_bob.email, user=user_bob)
+        user_eve = User.objects.create(email="test_verification_manager_eve@nalkins.cloud")
+        DjangoEmailVerifier.objects.create(user=user_eve, email=user_eve.email, is_verified=True)
+
+        result = DjangoEmailVerifier.objects.send_verification_emails(
+            subject='Verify your account',
+            body=lambda verification: 'uuid: {}'.format(verification.verification_uuid),
+            from_mail='noreply@nalkins.cloud',
+            recipients=[self.user.email, user_bob.email, user_eve.email, 'unknown@nalkins.cloud'],
+            chunk_size=1)
+
+        # already verified and unknown emails are not sent
+        self.assertEqual(result, {self.user.email: True, user_bob.email: True})
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[1].to, [user_bob.email])
+        self.assertEqual(mail.outbox[1].body, 'uuid: {}'.format(user_bob.get_uuid_of_email()))
+
+    def test_send_verification_emails_bad_header(self):
+        user_bob = User.objects.create(email="test_verification_manager_bob@nalkins.cloud")
+        DjangoEmailVerifier.objects.create_verification(email=user_bob.email, user=user_bob)
+
+        # BadHeaderError of one recipient does not stop the others
+        result = DjangoEmailVerifier.objects.send_verification_emails(
+            subject=lambda verification: 'Verify\n{}'.format(verification.email) if verification.user == user_bob
+            else 'Verify your account',
+            body='body',
+            from_mail='noreply@nalkins.cloud',
+            recipients=[user_bob.email, self.user.email])
+        self.assertEqual(result, {self.user.email: True, user_bob.email: False})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+
+    def test_send_verification_emails_of_users(self):
+        result = User.objects.send_verification_emails(subject='Verify your account',
+                                                       body='body',
+                                                       from_mail='noreply@nalkins.cloud',
+                                                       users=User.objects.filter(email=self.user.email))
+        self.assertEqual(result, {self.user.email: True})
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(DJANGO_EMAIL_VERIFIER_RESEND_LIMIT_PER_EMAIL=2, DJANGO_EMAIL_VERIFIER_RESEND_LIMIT_PER_IP=3)
+class TestResendThrottle(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="test_throttle@nalkins.cloud")
+        self.user.create_verification_email()
+
+    def send(self, user, ip='10.0.0.1'):
+        user.send_verification_email(subject='s', body='b', from_mail='noreply@nalkins.cloud', ip=ip)
+
+    def test_throttle_per_email(self):
+        self.send(self.user)
+        self.send(self.user, ip='10.0.0.2')
+        with self.assertRaises(VerificationEmailThrottled) as e:
+            self.send(self.user, ip='10.0.0.3')
+        self.assertEqual(e.exception.scope, 'email')
+        self.assertTrue(0 < e.exception.retry_after <= 2 * 3600)
+        self.assertEqual(len(mail.outbox), 2)
+
+        # throttled emails can not be queued either
+        with self.assertRaises(VerificationEmailThrottled):
+            self.user.enqueue_verification_email(subject='s', body='b', from_mail='noreply@nalkins.cloud')
+
+    def test_throttle_per_ip(self):
+        for index in range(3):
+            user = User.objects.create(email="test_throttle_{}@nalkins.cloud".format(index))
+            user.create_verification_email()
+            self.send(user)
+
+        with self.assertRaises(VerificationEmailThrottled) as e:
+            self.send(self.user)
+        self.assertEqual(e.exception.scope, 'ip')
+        # throttled attempt is not counted for the email
+        self.send(self.user, ip='10.0.0.2')
+        self.assertEqual(len(mail.outbox), 4)
+
+    @mock.patch('django_user_email_extension.throttling.time')
+    def test_throttle_window_boundary(self, mock_time):
+        # last seconds of a window
+        mock_time.time.return_value = 3600 * 1000 + 3590
+        self.send(self.user)
+        self.send(self.user, ip='10.0.0.2')
+
+        # a new window started, but previous attempts are still inside the sliding window
+        mock_time.time.return_value = 3600 * 1001 + 10
+        with self.assertRaises(VerificationEmailThrottled) as e:
+            self.send(self.user, ip='10.0.0.3')
+        self.assertEqual(e.exception.scope, 'email')
+        self.assertAlmostEqual(e.exception.retry_after, 1790)
+
+        # half of previous window is out, 2 * 0.5 + 1 attempts
+        mock_time.time.return_value = 3600 * 1001 + 1800
+        self.send(self.user, ip='10.0.0.3')
+        with self.assertRaises(VerificationEmailThrottled):
+            self.send(self.user, ip='10.0.0.4')
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_RESEND_WINDOW=0)
+    def test_throttle_window(self):
+        for _ in range(3):
+            self.send(self.user)
+        self.assertEqual(len(mail.outbox), 3)
+
+
+class TestVerificationBackends(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="test_backend@nalkins.cloud", password='password')
+
+    def test_database_backend(self):
+        token = self.user.create_verification_token()
+        self.assertEqual(token, str(self.user.get_uuid_of_email()))
+        self.assertEqual(get_verification_backend().activate(token), ActivationResult.ACTIVATED)
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_BACKEND=SIGNED_BACKEND)
+    def test_signed_token_backend(self):
+        with self.assertNumQueries(0):
+            token = self.user.create_verification_token()
+        self.assertFalse(DjangoEmailVerifier.objects.exists())
+
+        backend = get_verification_backend()
+        self.assertEqual(backend.activate(token), ActivationResult.ACTIVATED)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        self.assertEqual(backend.activate(token), ActivationResult.ALREADY_VERIFIED)
+        self.assertEqual(backend.activate(token + 'x'), ActivationResult.UNKNOWN)
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_BACKEND=SIGNED_BACKEND)
+    def test_signed_token_backend_password_changed(self):
+        token = self.user.create_verification_token()
+        self.user.set_password('new password')
+        self.user.save()
+        self.assertEqual(get_verification_backend().activate(token), ActivationResult.UNKNOWN)
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_BACKEND=SIGNED_BACKEND, DJANGO_EMAIL_VERIFIER_EXPIRE_TIME=-1)
+    def test_signed_token_backend_expired(self):
+        token = self.user.create_verification_token()
+        self.assertEqual(get_verification_backend().activate(token), ActivationResult.EXPIRED)
+
+
+class TestPurgeEmailVerificationsCommand(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="test_purge@nalkins.cloud")
+        self.expired = DjangoEmailVerifier.objects.create(user=self.user, email=self.user.email)
+        self.verified = DjangoEmailVerifier.objects.create(user=self.user, email=self.user.email, is_verified=True)
+        # make both verifications 30 days old
+        DjangoEmailVerifier.objects.update(date_created=self.expired.date_created - timedelta(days=30))
+        self.pending = DjangoEmailVerifier.objects.create(user=self.user, email=self.user.email)
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('purge_email_verifications', '--dry-run', stdout=out)
+        self.assertIn('1 email verifications would be deleted', out.getvalue())
+        self.assertEqual(DjangoEmailVerifier.objects.count(), 3)
+
+    def test_purge_expired(self):
+        out = StringIO()
+        call_command('purge_email_verifications', '--batch-size', '1', stdout=out)
+        self.assertIn('Deleted 1 email verifications', out.getvalue())
+        self.assertFalse(DjangoEmailVerifier.objects.filter(id=self.expired.id).exists())
+        self.assertEqual(DjangoEmailVerifier.objects.count(), 2)
+
+    def test_purge_verified_older_than(self):
+        call_command('purge_email_verifications', '--verified-older-than', '7', stdout=StringIO())
+        self.assertEqual(list(DjangoEmailVerifier.objects.values_list('id', flat=True)), [self.pending.id])
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_EXPIRE_TIME=None)
+    def test_purge_never_expires(self):
+        out = StringIO()
+        call_command('purge_email_verifications', stdout=out)
+        self.assertIn('No email verifications to delete', out.getvalue())
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected('relay is down')
+
+
+class TestEmailOutbox(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(email="test_outbox@nalkins.cloud")
+        self.user.create_verification_email()
+
+    def test_enqueue_verification_email(self):
+        self.user.enqueue_verification_email(subject='Verify your account', body='body', from_mail='noreply@nalkins.cloud')
+        # nothing is sent during the request
+        self.assertEqual(len(mail.outbox), 0)
+
+        out = StringIO()
+        call_command('run_email_outbox', '--once', '--workers', '2', stdout=out)
+        self.assertIn('Sent 1, will retry 0, failed 0', out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+
+        message = EmailOutbox.objects.get()
+        self.assertEqual(message.status, EmailOutbox.STATUS_SENT)
+        self.assertEqual(message.attempts, 1)
+
+    def test_enqueue_already_verified(self):
+        DjangoEmailVerifier.objects.update(is_verified=True)
+        self.assertIsNone(self.user.enqueue_verification_email(subject='s', body='b', from_mail='noreply@nalkins.cloud'))
+
+    def test_claim(self):
+        EmailOutbox.objects.enqueue('s', 'b', 'noreply@nalkins.cloud', self.user.email)
+        self.assertEqual(len(EmailOutbox.objects.claim(10)), 1)
+        # already claimed, lease did not end yet
+        self.assertEqual(len(EmailOutbox.objects.claim(10)), 0)
+
+    def test_claim_expired_lease(self):
+        message = EmailOutbox.objects.enqueue('s', 'b', 'noreply@nalkins.cloud', self.user.email)
+        for attempts in (1, 2):
+            # worker died, lease expired
+            self.assertEqual(EmailOutbox.objects.claim(10, max_attempts=2)[0].attempts, attempts)
+            EmailOutbox.objects.update(next_attempt_at=message.created_at)
+
+        self.assertEqual(EmailOutbox.objects.claim(10, max_attempts=2), [])
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (EmailOutbox.STATUS_FAILED, 2))
+        self.assertEqual(message.last_error, 'Lease expired, email was not reported as sent')
+
+    @override_settings(EMAIL_BACKEND='django_user_email_extension.tests.tests.FailingEmailBackend')
+    def test_send_pending_retry(self):
+        EmailOutbox.objects.enqueue('s', 'b', 'noreply@nalkins.cloud', self.user.email)
+        result = EmailOutbox.objects.send_pending(max_attempts=2, backoff_seconds=60)
+        self.assertEqual(result, {'sent': 0, 'retry': 1, 'failed': 0})
+
+        message = EmailOutbox.objects.get()
+        self.assertEqual(message.status, EmailOutbox.STATUS_PENDING)
+        self.assertEqual(message.last_error, 'relay is down')
+        # next attempt is in the future, so nothing to send now
+        self.assertEqual(EmailOutbox.objects.send_pending(), {'sent': 0, 'retry': 0, 'failed': 0})
+
+        EmailOutbox.objects.update(next_attempt_at=message.created_at)
+        result = EmailOutbox.objects.send_pending(max_attempts=2)
+        self.assertEqual(result, {'sent': 0, 'retry': 0, 'failed': 1})
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.STATUS_FAILED)
+
+    def test_send_pending_bad_header(self):
+        bad = EmailOutbox.objects.enqueue('bad\nsubject', 'b', 'noreply@nalkins.cloud', self.user.email)
+        good = EmailOutbox.objects.enqueue('s', 'b', 'noreply@nalkins.cloud', self.user.email)
+        # both emails are sent over the same connection
+        result = EmailOutbox.objects.send_pending(workers=1)
+        self.assertEqual(result, {'sent': 1, 'retry': 1, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(EmailOutbox.objects.get(id=good.id).status, EmailOutbox.STATUS_SENT)
+        bad.refresh_from_db()
+        self.assertEqual(bad.status, EmailOutbox.STATUS_PENDING)
+        self.assertIn('Header values can\'t contain newlines', bad.last_error)
+
 
 class TestAddressModel(TestCase):
     def setUp(self):
@@ -242,6 +646,40 @@ class TestAddressModel(TestCase):
                                        zip_code=000000,
                                        timezone='US/Eastern')
 
+    def test_zip_code_validation(self):
+        # 123456 is not a valid US zip code
+        with self.assertRaisesMessage(ValidationError, "Zip Code '123456' is not valid for United States of America"):
+            self.address_1.clean()
+        self.address_1.zip_code = 10001
+        self.address_1.clean()
+
+        form = UserAddressForm(self.user_alice, data={
+            'first_name': 'Alice', 'last_name': 'Smith', 'street_name': 'Main', 'street_number': '1',
+            'city': 'New York', 'country': 'US', 'zip_code': 123456, 'phone_number': self.number_1.id})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['zip_code'], ["Zip Code '123456' is not valid for United States of America"])
+
+    def test_timezone(self):
+        # US has more than one timezone
+        self.assertEqual(self.address_1.timezone, 'UTC')
+        self.assertEqual(self.address_3.timezone, 'US/Eastern')
+
+        address = UserAddress.objects.create(user=self.user_alice, street_name='Rothschild', street_number='1',
+                                             city='Tel Aviv', country='IL', zip_code=6688101,
+                                             phone_number=self.number_1)
+        self.assertEqual(address.timezone, 'Asia/Jerusalem')
+        self.assertEqual(get_country_timezones('us')[0], 'America/New_York')
+        self.assertIn(('Asia/Jerusalem', 'Asia/Jerusalem'), UserAddress._meta.get_field('timezone').choices)
+
+    def test_postal_code_validator(self):
+        self.assertTrue(postal_code_validator.is_valid('US', '10001-1234'))
+        self.assertFalse(postal_code_validator.is_valid('il', '1234'))
+        # countries without a pattern accept any code
+        self.assertTrue(postal_code_validator.is_valid('XX', 'anything'))
+        self.assertEqual(postal_code_validator.validate_many([('US', 10001), ('IL', '1234'), ('us', 'ABCDE'),
+                                                             ('IL', '1234567'), ('XX', '')]),
+                         [True, False, False, True, True])
+
     def test_country_field(self):
         # test country field https://github.com/SmileyChris/django-countries#countryfield
 
@@ -282,6 +720,111 @@ class TestUserAddressInteraction(TestCase):
         # current user should have 2 addresses
         self.assertEqual(len(UserAddress.objects.get_all_user_addresses(self.user_alice)), 2)
 
+    def test_default_address(self):
+        self.address_1.default_address = True
+        self.address_1.default_billing_address = True
+        self.address_1.save()
+
+        self.assertTrue(UserAddress.objects.set_default_address(self.user_alice, self.address_2.id))
+        self.assertEqual(list(UserAddress.objects.filter(default_address=True).values_list('id', flat=True)),
+                         [self.address_2.id])
+        # unknown address of user, nothing is changed
+        self.assertFalse(UserAddress.objects.set_default_billing_address('other@nalkins.cloud', self.address_2.id))
+        user_bob = User.objects.create_user(email="test_phone_number_2@nalkins.cloud")
+        bob_address = UserAddress.objects.create(user=user_bob, first_name='Bob', last_name='Cohen',
+                                                 street_name='Main', street_number='1', city='New York',
+                                                 country='US', zip_code=10001, phone_number=self.number_1)
+        self.assertFalse(UserAddress.objects.set_default_billing_address(self.user_alice, bob_address.id))
+        self.assertFalse(UserAddress.objects.set_default_billing_address(self.user_alice, 0))
+        self.assertEqual(list(UserAddress.objects.filter(default_billing_address=True).values_list('id', flat=True)),
+                         [self.address_1.id])
+
+        # save() unsets the previous default
+        self.address_1.default_address = True
+        self.address_1.save()
+        self.assertEqual(list(UserAddress.objects.filter(default_address=True).values_list('id', flat=True)),
+                         [self.address_1.id])
+
+    def test_fingerprint(self):
+        self.assertEqual(self.address_1.fingerprint, self.address_1.get_fingerprint())
+        duplicate = UserAddress(user=self.user_alice, first_name='Alice', last_name='Smith',
+                                street_name='98 columbus  ave.', street_number='Floor 5 - Apartment 15',
+                                city='SAN FRANCISCO', country='US', zip_code=123456, phone_number=self.number_1,
+                                default_address=True)
+        self.assertEqual(UserAddress.objects.find_duplicate(duplicate), self.address_1)
+        self.assertIsNone(UserAddress.objects.find_duplicate(self.address_1))
+
+        address, created = UserAddress.objects.get_or_create_address(duplicate)
+        self.assertFalse(created)
+        self.assertEqual(address, self.address_1)
+        self.assertTrue(UserAddress.objects.get(id=self.address_1.id).default_address)
+        self.assertEqual(UserAddress.objects.count(), 2)
+
+        # fingerprint is updated with the address
+        self.address_2.city = 'Brooklyn'
+        self.address_2.save(update_fields=['city'])
+        self.assertEqual(UserAddress.objects.get(id=self.address_2.id).fingerprint, self.address_2.get_fingerprint())
+
+    def test_address_form_upsert(self):
+        data = {'first_name': 'Alice', 'last_name': 'Smith', 'street_name': 'Main', 'street_number': '1',
+                'city': 'New York', 'country': 'US', 'zip_code': 10001, 'phone_number': self.number_1.id}
+        form = UserAddressForm(self.user_alice, data=data, upsert=True)
+        self.assertTrue(form.is_valid(), form.errors)
+        address = form.save()
+
+        # same address, other fields are updated
+        form = UserAddressForm(self.user_alice, upsert=True, data=dict(data, street_name='MAIN', city='new york',
+                                                                       last_name='Jones', notes='Ring twice'))
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save(), address)
+        self.assertEqual(UserAddress.objects.count(), 3)
+        address.refresh_from_db()
+        self.assertEqual((address.street_name, address.last_name, address.notes), ('Main', 'Jones', 'Ring twice'))
+
+        # without upsert, the address is added
+        form = UserAddressForm(self.user_alice, data=data)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertNotEqual(form.save(), address)
+        self.assertEqual(UserAddress.objects.count(), 4)
+
+    def test_backfill_address_fingerprints(self):
+        UserAddress.objects.update(fingerprint=None)
+        UserAddress.objects.filter(id=self.address_2.id).update(street_name=self.address_1.street_name,
+                                                                street_number=self.address_1.street_number,
+                                                                city=self.address_1.city,
+                                                                zip_code=self.address_1.zip_code)
+        out = StringIO()
+        call_command('backfill_address_fingerprints', '--batch-size', '1', stdout=out)
+        self.assertIn('Done, updated 2 addresses, found 1 duplicated addresses', out.getvalue())
+        self.assertFalse(UserAddress.objects.filter(fingerprint__isnull=True).exists())
+
+    def test_default_address_constraints(self):
+        UserAddress.objects.filter(id=self.address_1.id).update(default_address=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserAddress.objects.filter(id=self.address_2.id).update(default_address=True)
+
+    def test_with_contact_info(self):
+        self.number_1.verified = True
+        self.number_1.save()
+        user_bob = User.objects.create_user(email="test_phone_number_2@nalkins.cloud")
+        UserPhoneNumber.objects.create(number='+972-50-923-4567', owner=user_bob)
+
+        # users, phone numbers, addresses (with their phone number)
+        with self.assertNumQueries(3):
+            users = list(User.objects.with_contact_info().order_by('email'))
+            self.assertEqual(len(users[0].get_user_addresses()), 2)
+            self.assertEqual(users[0].get_user_addresses()[0].phone_number, self.number_1)
+            self.assertEqual(users[0].get_all_phone_numbers(), [self.number_1])
+            self.assertEqual(users[0].get_verified_phone_numbers(), [self.number_1])
+            self.assertEqual(users[0].get_verified_phone_numbers_list(), [self.number_1.number])
+            self.assertEqual(users[1].get_verified_phone_numbers_list(), [])
+            self.assertEqual(len(users[1].get_all_phone_numbers()), 1)
+
+        # without prefetch, a query per call
+        with self.assertNumQueries(2):
+            self.assertEqual(self.user_alice.get_verified_phone_numbers_list(), [self.number_1.number])
+            self.assertEqual(len(self.user_alice.get_user_addresses()), 2)
+
 
 class TestPhoneNumberModel(TestCase):
     def setUp(self):
@@ -341,3 +884,524 @@ class TestPhoneNumberModel(TestCase):
         self.number_1.refresh_from_db()
         self.assertEqual(False, self.number_1.verified)
         self.assertEqual(True, self.number_3.verified)
+
+    def test_save_query_count(self):
+        self.number_1.verified = True
+        self.number_1.save()
+        self.number_5.verified = True
+        self.number_5.save()
+
+        # savepoint, unverify same number, owner default exists, unset default, update, release
+        self.number_3.verified = True
+        UserPhoneNumber.objects.filter(id=self.number_2.id).update(is_default=True)
+        with self.assertNumQueries(5):
+            self.number_3.save()
+        self.number_1.refresh_from_db()
+        self.assertFalse(self.number_1.verified)
+        self.assertIsNotNone(self.number_1.verified_status_updated_at)
+        # bob already has a default number
+        self.assertFalse(self.number_3.is_default)
+
+        # savepoint, unset default, update, release
+        self.number_3.is_default = True
+        with self.assertNumQueries(4):
+            self.number_3.save()
+        self.number_2.refresh_from_db()
+        self.assertFalse(self.number_2.is_default)
+
+        # nothing changed, no update at all (savepoint, release)
+        with self.assertNumQueries(2):
+            self.number_3.save()
+
+        # not verified and not default, only the changed column is updated
+        self.number_4.number = '+972555512346'
+        with self.assertNumQueries(3):
+            self.number_4.save()
+        self.assertEqual(str(UserPhoneNumber.objects.get(id=self.number_4.id).number), '+972555512346')
+
+    def test_carrier_and_location(self):
+        self.assertEqual(self.number_2.carrier, 'Pelephone')
+        self.assertEqual(self.number_1.location, 'New York, NY')
+        self.assertEqual(UserPhoneNumber.objects.get(id=self.number_2.id).carrier, 'Pelephone')
+
+        # recalculated when number changes
+        self.number_2.number = '+12125095556'
+        self.number_2.save()
+        self.assertEqual(self.number_2.carrier, '')
+        self.assertEqual(self.number_2.location, 'New York, NY')
+
+        # and written when only the number is saved
+        self.number_2.number = '+972509234567'
+        self.number_2.save(update_fields=['number'])
+        self.assertEqual(UserPhoneNumber.objects.filter(id=self.number_2.id).values_list('carrier', 'location').get(),
+                         ('Pelephone', 'Israel'))
+
+    def test_backfill_phone_number_metadata(self):
+        UserPhoneNumber.objects.update(carrier=None, location=None)
+        out = StringIO()
+        call_command('backfill_phone_number_metadata', '--workers', '2', '--batch-size', '2', stdout=out)
+        self.assertIn('Done, updated 5 phone numbers', out.getvalue())
+        self.assertEqual(UserPhoneNumber.objects.get(id=self.number_2.id).carrier, 'Pelephone')
+        self.assertFalse(UserPhoneNumber.objects.filter(carrier__isnull=True).exists())
+
+        call_command('backfill_phone_number_metadata', '--workers', '1', stdout=out)
+        self.assertIn('Done, updated 0 phone numbers', out.getvalue())
+
+    def test_get_owner_of_verified_number(self):
+        self.assertIsNone(UserPhoneNumber.objects.get_owner_of_verified_number('+1-212-509-5555'))
+        self.number_3.verified = True
+        self.number_3.save()
+
+        self.assertEqual(UserPhoneNumber.objects.get_owner_of_verified_number('+1 (212) 509-5555'), self.user_bob)
+        self.assertEqual(UserPhoneNumber.objects.get_owner_of_verified_number('212-509-5555', region='US'),
+                         self.user_bob)
+        self.assertIsNone(UserPhoneNumber.objects.get_owner_of_verified_number('not a number'))
+
+    def test_owners_of_numbers(self):
+        self.number_1.verified = True
+        self.number_1.save()
+        self.number_2.verified = True
+        self.number_2.save()
+
+        with self.assertNumQueries(1):
+            owners = UserPhoneNumber.objects.owners_of_numbers(['+1-212-509-5555', '+972509234567',
+                                                                '+972555512345', 'not a number'])
+            self.assertEqual(owners, {'+12125095555': self.user_alice, '+972509234567': self.user_bob})
+
+    def test_unique_constraints(self):
+        self.number_1.verified = True
+        self.number_1.save()
+        # bypassing save() can not break the rules
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserPhoneNumber.objects.filter(id=self.number_3.id).update(verified=True)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserPhoneNumber.objects.filter(id=self.number_5.id).update(is_default=True)
+
+    def test_save_keeps_explicit_non_default(self):
+        self.number_1.verified = True
+        self.number_1.save()
+        self.assertTrue(self.number_1.is_default)
+
+        # owner already has a default (this number), so it is not forced back to default
+        self.number_1.is_default = False
+        self.number_1.save()
+        self.number_1.refresh_from_db()
+        self.assertFalse(self.number_1.is_default)
+
+
+class TestPhoneNumberBulkOperations(TestCase):
+    def setUp(self):
+        self.user_alice = User.objects.create_user(email="test_phone_number_1@nalkins.cloud")
+        self.user_bob = User.objects.create_user(email="test_phone_number_2@nalkins.cloud")
+        self.number_1 = UserPhoneNumber.objects.create(number='+12125095555', owner=self.user_alice, verified=True)
+
+    def test_bulk_import(self):
+        rows = [
+            {'owner': self.user_bob, 'number': '+1-212-509-5555', 'verified': True},
+            {'owner': self.user_bob.email, 'number': '+972-50-923-4567', 'is_default': True},
+            {'owner': self.user_bob, 'number': '+972509234567'},
+            {'owner': self.user_alice, 'number': '+12125095555'},
+            {'owner': 'unknown@nalkins.cloud', 'number': '+972555512345'},
+            {'owner': self.user_alice, 'number': 'not a number'},
+            {'owner': self.user_alice, 'number': '+972555512345', 'verified': True},
+            {'owner': self.user_bob, 'number': '+972555512345', 'verified': True},
+        ]
+        result = UserPhoneNumber.objects.bulk_import(rows, batch_size=100)
+
+        self.assertEqual(result['created'], 4)
+        self.assertEqual([reason for _, reason in result['skipped']],
+                         ['duplicate row', 'invalid number', 'number already exists for owner', 'unknown owner'])
+        self.assertEqual(result['conflicts'], [
+            (rows[6], 'number verified by another row'),
+            ((self.number_1.id, self.user_alice.email, '+12125095555'), 'verified number of another owner unverified'),
+        ])
+
+        # bob verified alice's number, so alice's number is unverified
+        self.number_1.refresh_from_db()
+        self.assertFalse(self.number_1.verified)
+        # bob has an explicit default, so verified numbers do not become default
+        self.assertEqual(UserPhoneNumber.objects.get_default_number_of_user(self.user_bob).number, '+972509234567')
+        self.assertEqual(UserPhoneNumber.objects.filter(number='+972555512345', verified=True).get().owner, self.user_bob)
+        self.assertIsNotNone(UserPhoneNumber.objects.get(number='+972555512345',
+                                                         owner=self.user_bob).verified_status_updated_at)
+
+    def test_bulk_mark_verified(self):
+        number_2 = UserPhoneNumber.objects.create(number='+12125095555', owner=self.user_bob)
+        number_3 = UserPhoneNumber.objects.create(number='+972509234567', owner=self.user_bob)
+
+        result = UserPhoneNumber.objects.bulk_mark_verified([
+            (self.user_bob, '+1-212-509-5555'),
+            (self.user_bob.email, '+972509234567'),
+            (self.user_alice, '+972555512345'),
+        ])
+        self.assertEqual(result['verified'], 2)
+        self.assertEqual(result['skipped'], [((self.user_alice, '+972555512345'), 'number not found for owner')])
+        self.assertEqual(result['conflicts'], [
+            ((self.number_1.id, self.user_alice.email, '+12125095555'), 'verified number of another owner unverified'),
+        ])
+
+        self.number_1.refresh_from_db()
+        number_2.refresh_from_db()
+        number_3.refresh_from_db()
+        self.assertFalse(self.number_1.verified)
+        self.assertTrue(number_2.verified)
+        self.assertTrue(number_3.verified)
+        # single default for bob
+        self.assertEqual(UserPhoneNumber.objects.filter(owner=self.user_bob, is_default=True).count(), 1)
+
+
+class TestPhoneNumberValidation(TestCase):
+
+    def test_validate_number(self):
+        result = validate_number('+1 (212) 509-5555')
+        self.assertEqual(result.e164, '+12125095555')
+        self.assertEqual(result.country_code, 1)
+        self.assertIsNone(result.error)
+        self.assertEqual(validate_number('212.509.5555', region='US').e164, '+12125095555')
+
+        self.assertEqual(validate_number('+1 000 000 0000').error, INVALID_NUMBER_ERROR)
+        result = validate_number('not a number')
+        self.assertIsNone(result.e164)
+        self.assertIsNotNone(result.error)
+
+    def test_validate_many(self):
+        numbers = ['+12125095555', 'not a number', '+972509234567', '+1 000 000 0000'] * 3
+        expected = [validate_number(number) for number in numbers]
+
+        self.assertEqual(list(validate_many(iter(numbers))), expected)
+        self.assertEqual(list(validate_many(iter(numbers), workers=2, chunk_size=2)), expected)
+
+    def test_verification_form(self):
+        form = PhoneNumberVerificationForm(instance=None, data={
+            'country_code': '1', 'phone_number': '2125095555', 'confirmation_type': 'sms'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['country_code'], 1)
+        self.assertEqual(form.cleaned_data['phone_number'].as_e164, '+12125095555')
+
+        form = PhoneNumberVerificationForm(instance=None, data={
+            'country_code': '+1', 'phone_number': '0000000000', 'confirmation_type': 'sms'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['phone_number'], [INVALID_NUMBER_ERROR])
+
+
+@override_settings(PHONE_VERIFICATION_SMS_BACKEND=LOCMEM_SMS_BACKEND, PHONE_VERIFICATION_MESSAGE='{code}')
+class TestPhoneVerificationCode(TestCase):
+
+    def setUp(self):
+        sms_backends.outbox.clear()
+        self.user = User.objects.create_user(email="test_phone_code@nalkins.cloud")
+        self.number_1 = UserPhoneNumber.objects.create(number='+1-212-509-5555', owner=self.user)
+        self.number_2 = UserPhoneNumber.objects.create(number='+972-50-923-4567', owner=self.user)
+
+    @override_settings(PHONE_VERIFICATION_SMS_BACKEND=None)
+    def test_sms_backend_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            PhoneVerificationCode.objects.send_codes([self.number_1])
+        self.assertFalse(PhoneVerificationCode.objects.exists())
+        with self.settings(DEBUG=True):
+            self.assertIsInstance(sms_backends.get_sms_backend(), sms_backends.ConsoleSMSBackend)
+
+    def test_send_codes(self):
+        # DELETE and INSERT, in a transaction (savepoint inside the test case)
+        with self.assertNumQueries(4):
+            self.assertEqual(PhoneVerificationCode.objects.send_codes([self.number_1, self.number_2]), 2)
+        self.assertEqual([number for number, _ in sms_backends.outbox], ['+12125095555', '+972509234567'])
+        self.assertEqual(len(sms_backends.outbox[0][1]), 6)
+        # codes are not stored in clear text
+        self.assertFalse(PhoneVerificationCode.objects.filter(code_hash=sms_backends.outbox[0][1]).exists())
+
+        # a new code replaces the previous one
+        self.number_1.send_verification_code()
+        self.assertEqual(PhoneVerificationCode.objects.filter(phone_number=self.number_1).count(), 1)
+
+    def test_verify_code(self):
+        self.assertEqual(self.number_1.verify_code('123456'), PhoneVerificationResult.UNKNOWN)
+        self.number_1.send_verification_code()
+        code = sms_backends.outbox[-1][1]
+
+        self.assertEqual(self.number_1.verify_code('x' + code), PhoneVerificationResult.INVALID)
+        self.assertEqual(self.number_1.verify_code(code), PhoneVerificationResult.VERIFIED)
+        self.number_1.refresh_from_db()
+        self.assertTrue(self.number_1.verified)
+        self.assertIsNotNone(self.number_1.verified_status_updated_at)
+        # codes are single use
+        self.assertEqual(self.number_1.verify_code(code), PhoneVerificationResult.UNKNOWN)
+
+    @override_settings(PHONE_VERIFICATION_MAX_ATTEMPTS=2)
+    def test_too_many_attempts(self):
+        self.number_1.send_verification_code()
+        code = sms_backends.outbox[-1][1]
+        self.assertEqual(self.number_1.verify_code('x'), PhoneVerificationResult.INVALID)
+        self.assertEqual(self.number_1.verify_code('x'), PhoneVerificationResult.INVALID)
+        self.assertEqual(self.number_1.verify_code(code), PhoneVerificationResult.TOO_MANY_ATTEMPTS)
+        self.assertFalse(UserPhoneNumber.objects.get(id=self.number_1.id).verified)
+
+    def test_expired_code_and_purge(self):
+        self.number_1.send_verification_code()
+        self.number_2.send_verification_code()
+        code = sms_backends.outbox[0][1]
+        PhoneVerificationCode.objects.filter(phone_number=self.number_1).update(expires_at=utc_now())
+        self.assertEqual(self.number_1.verify_code(code), PhoneVerificationResult.EXPIRED)
+
+        out = StringIO()
+        call_command('purge_phone_verification_codes', '--dry-run', stdout=out)
+        self.assertIn('1 phone verification codes would be deleted', out.getvalue())
+        call_command('purge_phone_verification_codes', stdout=out)
+        self.assertIn('Deleted 1 phone verification codes', out.getvalue())
+        self.assertEqual(list(PhoneVerificationCode.objects.values_list('phone_number', flat=True)), [self.number_2.id])
+
+
+class TestAdminChangelists(TestCase):
+
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(email='test_admin@nalkins.cloud', password='password')
+        self.client.force_login(self.admin_user)
+        self.add_rows(0)
+
+    @staticmethod
+    def add_rows(start):
+        for i in range(start, start + 3):
+            user = User.objects.create_user(email='test_admin_{}@nalkins.cloud'.format(i))
+            phone_number = UserPhoneNumber.objects.create(number='+1212509555{}'.format(i), owner=user, verified=True)
+            UserAddress.objects.create(user=user, first_name='Alice', last_name='Smith', street_name='Main',
+                                       street_number='1', city='New York', country='US', zip_code=10001,
+                                       phone_number=phone_number)
+            DjangoEmailVerifier.objects.create_verification(email=user.email, user=user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries(self):
+        for model in (User, DjangoEmailVerifier, UserAddress, UserPhoneNumber):
+            url = reverse('admin:django_user_email_extension_{}_changelist'.format(model._meta.model_name))
+            queries = self.count_queries(url)
+            # number of queries does not depend on number of rows (no query per related object)
+            self.add_rows(10 + 3 * len(model._meta.model_name))
+            self.assertEqual(self.count_queries(url), queries, url)
+            # no COUNT(*) of the unfiltered table, in addition to the filtered count
+            self.assertLessEqual(queries, 6, url)
+
+    def test_phone_number_change_form_swaps_default_and_verified(self):
+        user = User.objects.get(email='test_admin_0@nalkins.cloud')
+        other_number = UserPhoneNumber.objects.create(number='+972509234567', owner=user)
+        # verified by test_admin_1@nalkins.cloud
+        taken_number = UserPhoneNumber.objects.create(number='+12125095551', owner=user)
+
+        for number in (other_number, taken_number):
+            url = reverse('admin:django_user_email_extension_userphonenumber_change', args=[number.id])
+            response = self.client.post(url, {'number': str(number.number), 'owner': user.pk,
+                                              'verified': 'on', 'is_default': 'on'})
+            self.assertEqual(response.status_code, 302, response.context and response.context['errors'])
+            self.assertEqual(UserPhoneNumber.objects.get_default_number_of_user(user), number)
+        self.assertEqual(UserPhoneNumber.objects.get(number='+12125095551', verified=True), taken_number)
+
+    def test_address_add_form_swaps_default(self):
+        user = User.objects.get(email='test_admin_0@nalkins.cloud')
+        UserAddress.objects.filter(user=user).update(default_address=True)
+        response = self.client.post(reverse('admin:django_user_email_extension_useraddress_add'), {
+            'user': user.pk, 'first_name': 'Alice', 'last_name': 'Smith', 'street_name': 'Broadway',
+            'street_number': '2', 'city': 'New York', 'country': 'US', 'zip_code': 10002, 'timezone': '',
+            'phone_number': UserPhoneNumber.objects.get(owner=user).id, 'notes': '', 'default_address': 'on'})
+        self.assertEqual(response.status_code, 302, response.context and response.context['errors'])
+        self.assertEqual(UserAddress.objects.get(user=user, default_address=True).street_name, 'Broadway')
+
+    def test_changelist_search(self):
+        url = reverse('admin:django_user_email_extension_userphonenumber_changelist')
+        response = self.client.get(url, {'q': 'test_admin_1@'})
+        self.assertEqual(list(response.context['cl'].result_list.values_list('number', flat=True)), ['+12125095551'])
+
+
+@override_settings(DJANGO_EMAIL_VERIFIER_RESEND_BODY='Verify {email}: /verify/{uuid}/')
+class TestAdminActions(TestCase):
+
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(email='test_admin@nalkins.cloud', password='password')
+        self.client.force_login(self.admin_user)
+        self.user_alice = User.objects.create_user(email='test_admin_action_1@nalkins.cloud')
+        self.user_bob = User.objects.create_user(email='test_admin_action_2@nalkins.cloud')
+
+    def run_action(self, model, action, ids):
+        url = reverse('admin:django_user_email_extension_{}_changelist'.format(model._meta.model_name))
+        response = self.client.post(url, {'action': action, '_selected_action': ids}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        return [str(message) for message in response.context['messages']]
+
+    def test_activate_users(self):
+        self.user_bob.is_active = True
+        self.user_bob.save()
+        result = self.run_action(User, 'activate_users', [self.user_alice.pk, self.user_bob.pk])
+        self.assertEqual(result, ['1 users activated, 1 were already active'])
+        self.assertEqual(User.objects.filter(email__startswith='test_admin_action', is_active=True).count(), 2)
+
+    def test_resend_verification_emails(self):
+        verification = DjangoEmailVerifier.objects.create_verification(email=self.user_alice.email,
+                                                                       user=self.user_alice)
+        result = self.run_action(User, 'resend_verification_emails', [self.user_alice.pk, self.user_bob.pk])
+        self.assertEqual(result, ['1 verification emails sent, 0 failed, 1 without pending verification'])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].body, 'Verify {}: /verify/{}/'.format(self.user_alice.email,
+                                                                              verification.verification_uuid))
+
+    def test_resend_selected_verifications(self):
+        older = DjangoEmailVerifier.objects.create_verification(email=self.user_alice.email, user=self.user_alice,
+                                                                refresh_existing=False)
+        newer = DjangoEmailVerifier.objects.create_verification(email=self.user_alice.email, user=self.user_alice,
+                                                                refresh_existing=False)
+        verified = DjangoEmailVerifier.objects.create_verification(email=self.user_bob.email, user=self.user_bob)
+        DjangoEmailVerifier.objects.activate_by_uuid(verified.verification_uuid)
+
+        # the selected verification is sent, not the newest of the email
+        result = self.run_action(DjangoEmailVerifier, 'resend_verification_emails', [older.id, verified.id])
+        self.assertEqual(result, ['1 verification emails sent, 0 failed, 1 without pending verification'])
+        self.assertEqual(mail.outbox[0].body, 'Verify {}: /verify/{}/'.format(self.user_alice.email,
+                                                                              older.verification_uuid))
+
+        # two verifications of the same email are not reported as skipped
+        result = self.run_action(DjangoEmailVerifier, 'resend_verification_emails', [older.id, newer.id])
+        self.assertEqual(result, ['2 verification emails sent, 0 failed, 0 without pending verification'])
+        self.assertEqual({message.body for message in mail.outbox[1:]},
+                         {'Verify {}: /verify/{}/'.format(self.user_alice.email, verification.verification_uuid)
+                          for verification in (older, newer)})
+
+    def test_expire_and_purge_verifications(self):
+        pending = DjangoEmailVerifier.objects.create_verification(email=self.user_alice.email, user=self.user_alice)
+        verified = DjangoEmailVerifier.objects.create_verification(email=self.user_bob.email, user=self.user_bob)
+        DjangoEmailVerifier.objects.activate_by_uuid(verified.verification_uuid)
+
+        result = self.run_action(DjangoEmailVerifier, 'purge_verifications', [pending.id, verified.id])
+        self.assertEqual(result, ['1 verifications deleted, 1 pending were kept'])
+
+        result = self.run_action(DjangoEmailVerifier, 'expire_verifications', [pending.id])
+        self.assertEqual(result, ['1 verifications expired, 0 were not pending'])
+        self.assertTrue(DjangoEmailVerifier.objects.expired().filter(id=pending.id).exists())
+        # creation date is kept
+        self.assertEqual(DjangoEmailVerifier.objects.get(id=pending.id).date_created, pending.date_created)
+        self.assertTrue(DjangoEmailVerifier.objects.with_expiry().get(id=pending.id).is_expired)
+        self.assertEqual(DjangoEmailVerifier.objects.activate_by_uuid(pending.verification_uuid),
+                         ActivationResult.EXPIRED)
+        self.assertEqual(DjangoEmailVerifier.objects.activate_many([pending.verification_uuid]),
+                         {pending.verification_uuid: ActivationResult.EXPIRED})
+
+        self.run_action(DjangoEmailVerifier, 'purge_verifications', [pending.id])
+        self.assertFalse(DjangoEmailVerifier.objects.exists())
+
+    @override_settings(DJANGO_EMAIL_VERIFIER_EXPIRE_TIME=None)
+    def test_expire_verifications_without_expire_time(self):
+        pending = DjangoEmailVerifier.objects.create_verification(email=self.user_alice.email, user=self.user_alice)
+        result = self.run_action(DjangoEmailVerifier, 'expire_verifications', [pending.id])
+        self.assertEqual(result, ['1 verifications expired, 0 were not pending'])
+        self.assertFalse(DjangoEmailVerifier.objects.pending().exists())
+        self.assertTrue(DjangoEmailVerifier.objects.get(id=pending.id).is_uuid_expired())
+        self.assertEqual(DjangoEmailVerifier.objects.activate_by_uuid(pending.verification_uuid),
+                         ActivationResult.EXPIRED)
+
+    def test_mark_phone_numbers_verified(self):
+        number_1 = UserPhoneNumber.objects.create(number='+12125095555', owner=self.user_alice)
+        number_2 = UserPhoneNumber.objects.create(number='+972509234567', owner=self.user_alice)
+        number_3 = UserPhoneNumber.objects.create(number='+12125095555', owner=self.user_bob, verified=True)
+
+        result = self.run_action(UserPhoneNumber, 'mark_verified', [number_1.id, number_2.id])
+        self.assertEqual(result, ['2 phone numbers verified, 1 conflicts, 0 skipped'])
+        self.assertEqual(set(UserPhoneNumber.objects.filter(verified=True).values_list('id', flat=True)),
+                         {number_1.id, number_2.id})
+        number_3.refresh_from_db()
+        self.assertFalse(number_3.verified)
+        self.assertEqual(UserPhoneNumber.objects.filter(owner=self.user_alice, is_default=True).count(), 1)
+
+
+class TestImportAddressesCommand(TestCase):
+    columns = ('user', 'phone_number', 'first_name', 'last_name', 'street_name', 'street_number', 'city', 'state',
+               'country', 'zip_code', 'default_address')
+
+    def setUp(self):
+        self.user_alice = User.objects.create_user(email='test_import_1@nalkins.cloud')
+        self.user_bob = User.objects.create_user(email='test_import_2@nalkins.cloud')
+        self.number_1 = UserPhoneNumber.objects.create(number='+12125095555', owner=self.user_alice)
+        self.number_2 = UserPhoneNumber.objects.create(number='+972509234567', owner=self.user_bob)
+        self.existing = UserAddress.objects.create(user=self.user_alice, first_name='Alice', last_name='Smith',
+                                                   street_name='Main', street_number='1', city='New York',
+                                                   country='US', zip_code=10001, phone_number=self.number_1,
+                                                   default_address=True)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, name, rows):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            if name.endswith('.csv'):
+                f.write(','.join(self.columns) + '\n')
+                f.writelines(','.join(row) + '\n' for row in rows)
+            else:
+                # blank lines are skipped, but counted
+                f.writelines(json.dumps(dict(zip(self.columns, row))) + '\n\n' for row in rows)
+        return path
+
+    def read_rejects(self, path):
+        with open(path + '.rejects.jsonl', encoding='utf-8') as f:
+            return [(reject['line'], reject['reason']) for reject in map(json.loads, f)]
+
+    def test_import_csv(self):
+        path = self.write_file('addresses.csv', [
+            ('test_import_1@nalkins.cloud', '+1 212 509 5555', 'Alice', 'Smith', 'Broadway', '2', 'New York', 'NY',
+             'US', '10002', 'true'),
+            ('test_import_2@nalkins.cloud', '+972509234567', 'Bob', 'Cohen', 'Rothschild', '1', 'Tel Aviv', '',
+             'IL', '6688101', '1'),
+            ('test_import_2@nalkins.cloud', '+972509234567', 'Bob', 'Cohen', 'Dizengoff', '5', 'Tel Aviv', '',
+             'IL', '6688102', '1'),
+            ('unknown@nalkins.cloud', '+972509234567', 'Bob', 'Cohen', 'Dizengoff', '5', 'Tel Aviv', '',
+             'IL', '6688102', ''),
+            ('test_import_1@nalkins.cloud', '+12125095555', 'Alice', 'Smith', 'Broadway', '2', 'New York', '',
+             'US', '123456', ''),
+            ('test_import_1@nalkins.cloud', '+972509234567', 'Alice', 'Smith', 'Broadway', '2', 'New York', '',
+             'US', '10002', ''),
+            ('test_import_1@nalkins.cloud', '+12125095555', 'A', 'Smith', 'Broadway', '2', 'New York', '',
+             'US', '10002', ''),
+        ])
+        out = StringIO()
+        call_command('import_addresses', path, '--batch-size', '3', stdout=out)
+        self.assertIn('Done, imported 3 addresses, rejected 4', out.getvalue())
+        self.assertEqual(self.read_rejects(path), [
+            (5, 'Unknown user unknown@nalkins.cloud'),
+            (6, "Zip Code '123456' is not valid for United States of America"),
+            (7, 'Phone number +972509234567 not found for user'),
+            (8, 'first_name is too short'),
+        ])
+
+        # a single default per user, the last one of the user wins
+        self.assertEqual(set(UserAddress.objects.filter(default_address=True).values_list('street_name', flat=True)),
+                         {'Broadway', 'Dizengoff'})
+        self.assertEqual(UserAddress.objects.get(street_name='Rothschild').timezone, 'Asia/Jerusalem')
+
+    def test_import_skip_duplicates(self):
+        path = self.write_file('addresses.csv', [
+            ('test_import_1@nalkins.cloud', '+12125095555', 'Alice', 'Smith', 'MAIN.', '1', 'new york', '',
+             'US', '10001', ''),
+            ('test_import_2@nalkins.cloud', '+972509234567', 'Bob', 'Cohen', 'Main', '1', 'New York', '',
+             'US', '10001', ''),
+            ('test_import_2@nalkins.cloud', '+972509234567', 'Bob', 'Cohen', 'Main ', '1', 'New-York', '',
+             'US', '10001', ''),
+        ])
+        call_command('import_addresses', path, '--skip-duplicates', stdout=StringIO())
+        self.assertEqual(self.read_rejects(path), [(2, 'Duplicate of address {}'.format(self.existing.id)),
+                                                   (4, 'Duplicate of line 3')])
+        self.assertEqual(UserAddress.objects.get(user=self.user_bob).fingerprint, self.existing.fingerprint)
+
+    @override_settings(ENFORCE_USER_ADDRESS_VERIFIED_PHONE=True)
+    def test_import_jsonl_dry_run(self):
+        self.number_2.verified = True
+        self.number_2.save()
+        path = self.write_file('addresses.jsonl', [
+            ('test_import_1@nalkins.cloud', '+12125095555', 'Alice', 'Smith', 'Broadway', '2', 'New York', 'NY',
+             'USA', '10002', ''),
+            ('test_import_2@nalkins.cloud', '+972509234567', 'Bob', 'Cohen', 'Rothschild', '1', 'Tel Aviv', '',
+             'IL', '6688101', ''),
+        ])
+        out = StringIO()
+        call_command('import_addresses', path, '--dry-run', stdout=out)
+        self.assertIn('Done, validated 1 addresses, rejected 1', out.getvalue())
+        self.assertEqual(self.read_rejects(path), [(1, '+12125095555 has not been verified.')])
+        self.assertIn('Processed 2 rows', out.getvalue())
+        self.assertEqual(UserAddress.objects.count(), 1)
@@ -0,0 +1,88 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class VerificationEmailThrottled(Exception):
+    def __init__(self, scope, retry_after):
+        self.scope = scope
+        self.retry_after = retry_after
+        super().__init__('Too many verification emails per {}, retry in {} seconds'.format(scope, int(retry_after) + 1))
+
+
+def _cache_key(scope, value):
+    return 'django_user_email_extension:resend:{}:{}'.format(scope, hashlib.sha256(value.lower().encode()).hexdigest())
+
+
+def _incr(cache, key, timeout):
+    """
+    atomic increment of a counter, created (as 0) if missing
+    :return: value of counter after increment
+    """
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # counter expired between add() and incr()
+        cache.add(key, 1, timeout)
+        return 1
+
+
+def _retry_after(previous, current, limit, window, elapsed):
+    """
+    seconds until an attempt is allowed, for a window with 'current' attempts (not counting the throttled one),
+    'elapsed' seconds after it started, and 'previous' attempts in the window before it
+    """
+    if current < limit:
+        # allowed once enough of the previous window slides out
+        return window * (1 - (limit - current - 1) / previous) - elapsed
+    # allowed in the next window, once enough of this window slides out
+    return window - elapsed + window * max(0.0, 1 - (limit - 1) / max(current, 1))
+
+
+def check_resend_throttle(email, ip=None):
+    """
+    sliding window throttle of verification emails, per email and per ip, stored in the django cache.
+    limits are set by DJANGO_EMAIL_VERIFIER_RESEND_LIMIT_PER_EMAIL and DJANGO_EMAIL_VERIFIER_RESEND_LIMIT_PER_IP
+    (number of emails per DJANGO_EMAIL_VERIFIER_RESEND_WINDOW seconds, default 3600), a limit that is not set is
+    not enforced, a window of 0 disables throttling. the cache used is DJANGO_EMAIL_VERIFIER_THROTTLE_CACHE
+    (default 'default').
+    attempts are counted per fixed window with atomic cache.add() and cache.incr(), and the sliding window count
+    is estimated as previous * (1 - elapsed / window) + current, the previous window counted by the part of it
+    that is still inside the sliding window.
+    if allowed, the attempt is recorded, otherwise VerificationEmailThrottled is raised (and the attempt is not counted).
+    :param email: recipient email
+    :param ip: ip address of the request, or None
+    """
+    window = int(getattr(settings, 'DJANGO_EMAIL_VERIFIER_RESEND_WINDOW', 3600))
+    if window <= 0:
+        return
+    limits = (
+        ('email', email, getattr(settings, 'DJANGO_EMAIL_VERIFIER_RESEND_LIMIT_PER_EMAIL', None)),
+        ('ip', ip, getattr(settings, 'DJANGO_EMAIL_VERIFIER_RESEND_LIMIT_PER_IP', None)),
+    )
+    cache = caches[getattr(settings, 'DJANGO_EMAIL_VERIFIER_THROTTLE_CACHE', 'default')]
+    now = time.time()
+    window_index = int(now // window)
+    elapsed = now - window_index * window
+
+    counted = []
+    for scope, value, limit in limits:
+        if limit is None or not value:
+            continue
+        key = _cache_key(scope, value)
+        previous = cache.get('{}:{}'.format(key, window_index - 1), 0)
+        current_key = '{}:{}'.format(key, window_index)
+        counted.append(current_key)
+        # counters are kept for two windows, as the next window reads them
+        current = _incr(cache, current_key, 2 * window)
+        if previous * (1 - elapsed / window) + current > limit:
+            for counted_key in counted:
+                try:
+                    cache.decr(counted_key)
+                except ValueError:
+                    pass
+            raise VerificationEmailThrottled(scope, retry_after=_retry_after(previous, current - 1, limit,
+                                                                             window, elapsed))
@@ -0,0 +1,47 @@
+from functools import lru_cache
+from zoneinfo import available_timezones
+
+# keys of the system tz database that are not timezones
+_EXCLUDED_TIMEZONES = {'Factory', 'localtime'}
+
+
+@lru_cache(maxsize=None)
+def _timezone_choices():
+    timezones = available_timezones() - _EXCLUDED_TIMEZONES
+    if not timezones:
+        # no system tz database (and no 'tzdata' package)
+        import pytz
+        timezones = pytz.all_timezones
+    return tuple((timezone, timezone) for timezone in sorted(timezones))
+
+
+def get_timezone_choices():
+    """
+    choices of all timezones, used as lazy 'choices' of model fields,
+    the list is built on first use (not on import), and only once per process
+    :return: tuple of (timezone, timezone) tuples
+    """
+    return _timezone_choices()
+
+
+@lru_cache(maxsize=None)
+def _timezones_by_country():
+    import pytz
+    return {country.upper(): tuple(timezones) for country, timezones in pytz.country_timezones.items()}
+
+
+def get_country_timezones(country):
+    """
+    :param country: country code, eg 'US', or Country object
+    :return: tuple of timezone names used in country, empty if country is unknown
+    """
+    return _timezones_by_country().get(str(country).upper(), ())
+
+
+def get_country_timezone(country):
+    """
+    :param country: country code, eg 'IL', or Country object
+    :return: timezone name if country has a single timezone, otherwise None
+    """
+    timezones = get_country_timezones(country)
+    return timezones[0] if len(timezones) == 1 else None
@@ -0,0 +1,16 @@
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """
+    split an iterable into lists of at most 'size' items, without loading the whole iterable into memory
+    :param iterable: any iterable (list, generator, QuerySet iterator)
+    :param size: maximum number of items per chunk
+    :return: generator of lists
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
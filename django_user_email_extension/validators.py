@@ -1,8 +1,15 @@
 
+import re
+import threading
+from collections import defaultdict
+
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from datetime import datetime
+from django_countries import countries
+
+from . import ZIP_CODES_REGEX
 
 
 def phone_number_validator():
@@ -34,3 +41,66 @@ def validate_alphabetic_string(string):
     """
     if not string.isalpha():
         raise ValidationError(message='Must be Alphabet string.')
+
+
+class PostalCodeValidator:
+    """
+    validate postal (zip) codes of countries, using ZIP_CODES_REGEX patterns,
+    all patterns are compiled once, on first use. countries without a pattern accept any code
+    """
+
+    def __init__(self, patterns=None):
+        self._patterns = ZIP_CODES_REGEX if patterns is None else patterns
+        self._compiled = None
+        self._lock = threading.Lock()
+
+    @property
+    def compiled_patterns(self):
+        if self._compiled is None:
+            with self._lock:
+                if self._compiled is None:
+                    self._compiled = {country: re.compile(pattern) for country, pattern in self._patterns.items()}
+        return self._compiled
+
+    def is_valid(self, country, code):
+        """
+        :param country: country code, eg 'US', or Country object
+        :param code: postal code string or integer
+        :return: boolean
+        """
+        pattern = self.compiled_patterns.get(str(country).upper())
+        return pattern is None or pattern.match(str(code)) is not None
+
+    def validate(self, country, code):
+        """
+        raise ValidationError if code is not a valid postal code of country
+        :param country: country code, eg 'US', or Country object
+        :param code: postal code string or integer
+        """
+        if not self.is_valid(country, code):
+            raise ValidationError(message='Zip Code \'{}\' is not valid for {}'.format(code, countries.name(country)))
+
+    def validate_many(self, pairs):
+        """
+        validate many postal codes, grouped by country, so each pattern runs on all codes of its country at once
+        :param pairs: iterable of (country, code) tuples
+        :return: list of booleans, in input order
+        """
+        pairs = list(pairs)
+        results = [True] * len(pairs)
+        indexes_by_country = defaultdict(list)
+        for index, (country, _) in enumerate(pairs):
+            indexes_by_country[str(country).upper()].append(index)
+
+        compiled_patterns = self.compiled_patterns
+        for country, indexes in indexes_by_country.items():
+            pattern = compiled_patterns.get(country)
+            if pattern is None:
+                continue
+            match = pattern.match
+            for index in indexes:
+                results[index] = match(str(pairs[index][1])) is not None
+        return results
+
+
+postal_code_validator = PostalCodeValidator()
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.module_loading import import_string
+
+from django_user_email_extension.models import ActivationResult, DjangoEmailVerifier, User, utc_now
+
+DEFAULT_VERIFICATION_BACKEND = 'django_user_email_extension.verification_backends.DatabaseVerificationBackend'
+
+
+def get_verification_backend():
+    """
+    return an instance of the backend set in DJANGO_EMAIL_VERIFIER_BACKEND setting,
+    defaults to DatabaseVerificationBackend
+    """
+    return import_string(getattr(settings, 'DJANGO_EMAIL_VERIFIER_BACKEND', DEFAULT_VERIFICATION_BACKEND))()
+
+
+class BaseVerificationBackend:
+
+    def create_token(self, user):
+        """
+        create a verification token for users email, the token should be sent to the user (as part of a link)
+        :param user: User object
+        :return: token string
+        """
+        raise NotImplementedError('subclasses of BaseVerificationBackend must provide a create_token() method')
+
+    def activate(self, token):
+        """
+        verify a token, and activate its user
+        :param token: token string
+        :return: ActivationResult
+        """
+        raise NotImplementedError('subclasses of BaseVerificationBackend must provide an activate() method')
+
+
+class DatabaseVerificationBackend(BaseVerificationBackend):
+    """
+    tokens are uuids of DjangoEmailVerifier objects
+    """
+
+    def create_token(self, user):
+        return str(DjangoEmailVerifier.objects.create_verification(email=user.email, user=user).verification_uuid)
+
+    def activate(self, token):
+        return DjangoEmailVerifier.objects.activate_by_uuid(token)
+
+
+class SignedTokenVerificationBackend(BaseVerificationBackend):
+    """
+    tokens are signed (HMAC, using SECRET_KEY) and timestamped, no database row is created per token.
+    tokens expire after DJANGO_EMAIL_VERIFIER_EXPIRE_TIME hours (never if not set),
+    and are bound to users password and active status, so they can not be used after activation or password change.
+    """
+    salt = 'django_user_email_extension.verification_backends.SignedTokenVerificationBackend'
+
+    def _user_state(self, user):
+        return salted_hmac(self.salt, '{}{}{}'.format(user.email, user.password, user.is_active)).hexdigest()
+
+    def create_token(self, user):
+        return signing.dumps({'email': user.email, 'state': self._user_state(user)}, salt=self.salt)
+
+    def activate(self, token):
+        hours_to_expire = getattr(settings, 'DJANGO_EMAIL_VERIFIER_EXPIRE_TIME', None)
+        max_age = timedelta(hours=hours_to_expire) if hours_to_expire is not None else None
+        try:
+            payload = signing.loads(token, salt=self.salt, max_age=max_age)
+        except signing.SignatureExpired:
+            return ActivationResult.EXPIRED
+        except signing.BadSignature:
+            return ActivationResult.UNKNOWN
+
+        user = User.objects.filter(email=payload.get('email')).only('email', 'password', 'is_active').first()
+        if user is None:
+            return ActivationResult.UNKNOWN
+        if user.is_active:
+            return ActivationResult.ALREADY_VERIFIED
+        if not constant_time_compare(payload.get('state', ''), self._user_state(user)):
+            # password changed since the token was created
+            return ActivationResult.UNKNOWN
+
+        if User.objects.filter(email=user.email, is_active=False).update(is_active=True, last_update_date=utc_now()):
+            return ActivationResult.ACTIVATED
+        return ActivationResult.ALREADY_VERIFIED